@@ -0,0 +1,419 @@
+import gzip
+import json
+import os
+import random
+import shutil
+import sys
+from datetime import datetime, timedelta
+from itertools import accumulate
+from urllib.parse import quote
+
+from decouple import config
+
+from database.archive import Archive
+from py.utils import logger
+import py.utils as u
+import py.variants as variants
+
+
+CORPUS_DIR = config('CORPUS_DIR', default=os.path.join(os.path.dirname(__file__), '..', 'cache', 'corpus'))
+# number of players, by default one for every 20 games
+CORPUS_PLAYERS = config('CORPUS_PLAYERS', default=0, cast=int)
+# games in one json lines file
+CORPUS_FILE_SIZE = config('CORPUS_FILE_SIZE', default=100000, cast=int)
+# also write the games in the archive format served by swagger/standin.py
+CORPUS_ARCHIVE = config('CORPUS_ARCHIVE', default=False, cast=bool)
+# number of open player files while histories are grouped
+CORPUS_OPEN_FILES = config('CORPUS_OPEN_FILES', default=256, cast=int)
+
+# share of games by number of players
+NUM_PLAYERS_WEIGHTS = {2: 0.35, 3: 0.35, 4: 0.18, 5: 0.09, 6: 0.03}
+# variants with other ranks, piles or deck sizes than the simulation supports
+EXCLUDED_VARIANTS = ('Up or Down', 'Reversed', 'Sudoku', 'Critical', 'Throw It in a Hole')
+NOTE_WORDS = ['f', 'cm', 'chop', 'trash', 'k', '5 save', 'tempo', 'finesse', 'bluff', 'prompt', 'r', 'y', 'g', 'b',
+              'p', '1', '2', '3', '4', 'x', '?', 'ok']
+FIRST_DATE = datetime(2018, 1, 1)
+# changed whenever the generated games change, so cached corpora are generated again
+CORPUS_VERSION = 2
+
+
+def is_one_of_each(suit):
+    return suit.startswith('Dark') or suit in ('Black', 'Gray', 'Cocoa Rainbow', 'Gray Pink')
+
+
+SUITS_JSON = os.path.join(os.path.dirname(__file__), '..', 'resources', 'suits.json')
+
+
+def read_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.loads(f.read())
+
+
+def clue_colors(variant, suits_by_name):
+    """Clue colors of a variant in suit order, like the colors column of the variants table.
+
+    Parameters
+    ----------
+    variant : dict
+        Variant from resources/variants.json
+    suits_by_name : dict
+        Suits from resources/suits.json by name
+
+    Returns
+    -------
+    list
+        Clue colors
+    """
+    if 'clueColors' in variant:
+        return list(variant['clueColors'])
+    colors = []
+    for suit in variant['suits']:
+        suit = suits_by_name[suit.replace(' Reversed', '')]
+        if suit.get('allClueColors') or suit.get('noClueColors') or suit.get('prism'):
+            continue
+        for color in suit.get('clueColors', [suit['name']]):
+            if color not in colors:
+                colors.append(color)
+    return colors
+
+
+def variant_colors():
+    """Clue colors of every variant of resources/variants.json by variant id."""
+    suits_by_name = {suit['name']: suit for suit in read_json(SUITS_JSON)}
+    return {v['id']: clue_colors(v, suits_by_name) for v in read_json(variants.VARIANTS_JSON)}
+
+
+def touching_colors(variant, suits_by_name, colors):
+    """Indices of the clue colors touching each card of a variant.
+
+    Returns
+    -------
+    list
+        Color indices by suit index and rank, ranks 1 to 5
+    """
+    touching = []
+    for suit in variant['suits']:
+        suit = suits_by_name[suit.replace(' Reversed', '')]
+        by_rank = [[]]
+        for rank in range(1, 6):
+            if variant.get('colorCluesTouchNothing') or suit.get('noClueColors') or \
+                    rank == variant.get('specialRank') and variant.get('specialNoClueColors'):
+                by_rank.append([])
+            elif suit.get('allClueColors') or rank == variant.get('specialRank') and variant.get('specialAllClueColors'):
+                by_rank.append(list(range(len(colors))))
+            elif suit.get('prism'):
+                by_rank.append([(rank - 1) % len(colors)] if len(colors) != 0 else [])
+            else:
+                by_rank.append([colors.index(c) for c in suit.get('clueColors', [suit['name']]) if c in colors])
+        touching.append(by_rank)
+    return touching
+
+
+def build_deck(suits, rng):
+    deck = []
+    for suit_index, suit in enumerate(suits):
+        ranks = [1, 2, 3, 4, 5] if is_one_of_each(suit) else [1, 1, 1, 2, 2, 3, 3, 4, 4, 5]
+        deck += [{'suitIndex': suit_index, 'rank': rank} for rank in ranks]
+    rng.shuffle(deck)
+    return deck
+
+
+def zipf_weights(n, exponent):
+    return list(accumulate(1 / (i + 1) ** exponent for i in range(n)))
+
+
+class Population:
+    """Players with skewed activity, skill and note taking, all derived from the seed."""
+
+    def __init__(self, size, seed):
+        rng = random.Random(f'{seed}:players')
+        self.names = [f'player{i:06d}' for i in range(size)]
+        self.cum_weights = zipf_weights(size, 1.1)
+        self.skill = [rng.betavariate(5, 2) for _ in range(size)]
+        self.note_rate = [rng.random() * 0.3 if rng.random() < 0.6 else 0 for _ in range(size)]
+
+    def team(self, num_players, rng):
+        team = []
+        while len(team) < num_players:
+            i = rng.choices(range(len(self.names)), cum_weights=self.cum_weights)[0]
+            if i not in team:
+                team.append(i)
+        return team
+
+
+def simulate(deck, num_players, skill, rng, touching):
+    """Plays a game with a simple policy: play a playable card if the team is good enough to know it,
+    else give a clue touching a card or discard the oldest card.
+
+    Parameters
+    ----------
+    deck : list
+        Cards in the export format
+    num_players : int
+        Number of players
+    skill : float
+        Average skill of the team
+    rng : random.Random
+        Random number generator of the game
+    touching : list
+        Indices of the clue colors touching each card by suit index and rank
+
+    Returns
+    -------
+    actions : list
+        Actions in the export format
+    score : int
+        Score, 0 after a strikeout
+    end_condition : int
+        1 for a normal end, 2 for a strikeout
+    """
+    num_suits = max(c['suitIndex'] for c in deck) + 1
+    max_score = 5 * num_suits
+    cards_in_hand = u.get_number_of_cards_in_hand(num_players, False, False)
+    # newest card first
+    hands = [list(range(p * cards_in_hand, (p + 1) * cards_in_hand))[::-1] for p in range(num_players)]
+    next_card = cards_in_hand * num_players
+    piles = [0] * num_suits
+    clues, strikes, final_turns = 8, 0, None
+    actions = []
+    turn = 0
+    while True:
+        player = turn % num_players
+        hand = hands[player]
+        playable = [c for c in hand if deck[c]['rank'] == piles[deck[c]['suitIndex']] + 1]
+        r = rng.random()
+        if r > 0.99:
+            action = {'type': 0, 'target': rng.choice(hand), 'value': 0}
+        elif len(playable) != 0 and r < skill:
+            action = {'type': 0, 'target': playable[0], 'value': 0}
+        elif clues > 0 and (clues == 8 or r < skill + (1 - skill) * 0.5):
+            target = (player + rng.randrange(1, num_players)) % num_players
+            card = deck[rng.choice(hands[target])]
+            colors = touching[card['suitIndex']][card['rank']]
+            if rng.random() < 0.5 and len(colors) != 0:
+                action = {'type': 2, 'target': target, 'value': rng.choice(colors)}
+            else:
+                action = {'type': 3, 'target': target, 'value': card['rank']}
+        else:
+            action = {'type': 1, 'target': hand[-1], 'value': 0}
+        actions.append(action)
+
+        if action['type'] in [2, 3]:
+            clues -= 1
+        else:
+            card = deck[action['target']]
+            hand.remove(action['target'])
+            if action['type'] == 1:
+                clues += 1
+            elif card['rank'] == piles[card['suitIndex']] + 1:
+                piles[card['suitIndex']] += 1
+                if card['rank'] == 5 and clues < 8:
+                    clues += 1
+            else:
+                strikes += 1
+            if next_card < len(deck):
+                hand.insert(0, next_card)
+                next_card += 1
+                if next_card == len(deck):
+                    final_turns = num_players + 1
+        turn += 1
+        if final_turns is not None:
+            final_turns -= 1
+        if strikes == 3:
+            end_condition, score = 2, 0
+            break
+        if sum(piles) == max_score or final_turns == 0:
+            end_condition, score = 1, sum(piles)
+            break
+    actions.append({'type': 4, 'target': player, 'value': end_condition})
+    return actions, score, end_condition
+
+
+class Corpus:
+    """Generates games deterministically: the game with a given id depends only on the seed and
+    the previous games on its deck seed."""
+
+    def __init__(self, seed=0, num_players=None, first_id=1):
+        self.seed = seed
+        self.first_id = first_id
+        rng = random.Random(f'{seed}:variants')
+        self.variants = [v for v in variants.from_json() if not any(e in v.name for e in EXCLUDED_VARIANTS)]
+        # No Variant first, the rest by popularity in a random order
+        rng.shuffle(self.variants)
+        self.variants.sort(key=lambda v: v.variant_id != 0)
+        self.variant_weights = zipf_weights(len(self.variants), 1.3)
+        suits_by_name = {suit['name']: suit for suit in read_json(SUITS_JSON)}
+        self.colors, self.touching = {}, {}
+        for v in read_json(variants.VARIANTS_JSON):
+            self.colors[v['id']] = clue_colors(v, suits_by_name)
+            self.touching[v['id']] = touching_colors(v, suits_by_name, self.colors[v['id']])
+        self.population = Population(num_players, seed)
+        self.seed_games = {}
+
+    def game(self, game_id):
+        """Generates a game.
+
+        Parameters
+        ----------
+        game_id : int
+            Game id
+
+        Returns
+        -------
+        g : dict
+            Game in the export format
+        s : dict
+            The game in the history-full format
+        """
+        rng = random.Random(f'{self.seed}:{game_id}')
+        num_players = rng.choices(list(NUM_PLAYERS_WEIGHTS), weights=list(NUM_PLAYERS_WEIGHTS.values()))[0]
+        variant = rng.choices(self.variants, cum_weights=self.variant_weights)[0]
+        team = self.population.team(num_players, rng)
+        players = [self.population.names[i] for i in team]
+        # popular variants are played on a few hundred seeds, so decks repeat
+        seed = f'p{num_players}v{variant.variant_id}s{rng.randrange(1, 300)}'
+        deck = build_deck(variant.suits, random.Random(f'{self.seed}:{seed}'))
+        skill = sum(self.population.skill[i] for i in team) / num_players
+        actions, score, end_condition = simulate(deck, num_players, skill, rng, self.touching[variant.variant_id])
+        notes = [
+            [rng.choice(NOTE_WORDS) if rng.random() < self.population.note_rate[i] else '' for _ in deck]
+            for i in team
+        ]
+        timed = rng.random() < 0.2
+        time_base, time_per_turn = (rng.choice([60, 120, 180]), rng.choice([10, 20])) if timed else (0, 0)
+        finished = FIRST_DATE + timedelta(minutes=(game_id - self.first_id) * 2 + rng.randrange(2))
+        started = finished - timedelta(seconds=len(actions) * rng.randrange(5, 40))
+        self.seed_games[seed] = self.seed_games.get(seed, 0) + 1
+        g = {
+            'id': game_id,
+            'players': players,
+            'deck': deck,
+            'actions': actions,
+            'notes': notes,
+            'options': {'variant': variant.name, 'timed': timed, 'timeBase': time_base, 'timePerTurn': time_per_turn},
+            'seed': seed
+        }
+        s = {
+            'id': game_id,
+            'options': {
+                'numPlayers': num_players,
+                'startingPlayer': 0,
+                'variantID': variant.variant_id,
+                'variantName': variant.name,
+                'timed': timed,
+                'timeBase': time_base,
+                'timePerTurn': time_per_turn,
+                'speedrun': rng.random() < 0.02,
+                'cardCycle': False,
+                'deckPlays': False,
+                'emptyClues': False,
+                'oneExtraCard': False,
+                'oneLessCard': False,
+                'allOrNothing': False,
+                'detrimentalCharacters': False
+            },
+            'seed': seed,
+            'score': score,
+            'numTurns': len(actions) - 1,
+            'endCondition': end_condition,
+            'datetimeStarted': started.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'datetimeFinished': finished.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'numGamesOnThisSeed': self.seed_games[seed],
+            'playerNames': players,
+            'tags': '',
+            'users_tags': []
+        }
+        return g, s
+
+    def games(self, n):
+        for game_id in range(self.first_id, self.first_id + n):
+            yield self.game(game_id)
+
+
+class HistoryWriter:
+    """Groups history rows by player in temporary json lines files, keeping a bounded number of them open,
+    then writes each history newest first in the history cache format."""
+
+    def __init__(self, directory, open_files=CORPUS_OPEN_FILES):
+        self.directory = directory
+        self.tmp_directory = os.path.join(directory, 'tmp')
+        self.open_files = open_files
+        self.files = {}
+        self.newest = {}
+        u.mkdir_p(self.tmp_directory)
+
+    def add(self, s):
+        line = json.dumps(s) + '\n'
+        for player in s['playerNames']:
+            if player not in self.files:
+                if len(self.files) >= self.open_files:
+                    self.files.pop(next(iter(self.files))).close()
+                self.files[player] = open(os.path.join(self.tmp_directory, quote(player, safe='')), 'a', encoding='utf-8')
+            self.files[player].write(line)
+            self.newest[player] = s['id']
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        for player in self.newest:
+            tmp_path = os.path.join(self.tmp_directory, quote(player, safe=''))
+            with open(tmp_path, 'r', encoding='utf-8') as f:
+                history = [json.loads(line) for line in f][::-1]
+            with gzip.open(os.path.join(self.directory, f'{quote(player, safe="")}.json.gz'), 'wt', encoding='utf-8') as f:
+                f.write(json.dumps(history))
+        shutil.rmtree(self.tmp_directory)
+        with open(os.path.join(self.directory, 'index.json'), 'w', encoding='utf-8') as f:
+            f.write(json.dumps(self.newest))
+
+
+def generate(n, seed=0, directory=CORPUS_DIR, num_players=CORPUS_PLAYERS, first_id=1, archive=CORPUS_ARCHIVE):
+    """Writes a synthetic corpus: exports as json lines files in games/, players' histories
+    in the history cache format in histories/ and optionally the archive in archive/.
+
+    Parameters
+    ----------
+    n : int
+        Number of games
+    seed : int
+        Seed, the same seed and parameters give the same corpus
+    directory : str
+        Output directory
+    num_players : int
+        Number of players, one for every 20 games by default
+    first_id : int
+        Id of the first game
+    archive : bool
+        A flag representing whether the archive is written
+    """
+    corpus = Corpus(seed, num_players or max(n // 20, 10), first_id)
+    u.mkdir_p(os.path.join(directory, 'games'))
+    histories = HistoryWriter(os.path.join(directory, 'histories'))
+    games_archive = Archive(os.path.join(directory, 'archive')) if archive else None
+    f = None
+    start_time = u.current_time()
+    for i, (g, s) in enumerate(corpus.games(n)):
+        if i % CORPUS_FILE_SIZE == 0:
+            if f is not None:
+                f.close()
+            f = open(os.path.join(directory, 'games', f'games_{i // CORPUS_FILE_SIZE:04d}.txt'), 'w', encoding='utf-8')
+            logger.info(f'{i} games')
+        f.write(json.dumps(g) + '\n')
+        histories.add(s)
+        if games_archive is not None:
+            games_archive.append(g, s)
+    if f is not None:
+        f.close()
+    histories.close()
+    if games_archive is not None:
+        games_archive.close()
+    seconds = u.time_spent(start_time).total_seconds()
+    logger.info(f'{n} games of {len(histories.newest)} players in {directory}, {round(seconds)}s')
+
+
+if __name__ == "__main__":
+    # <number of games> [seed] [output directory]
+    generate(
+        int(sys.argv[1]),
+        int(sys.argv[2]) if len(sys.argv) > 2 else 0,
+        sys.argv[3] if len(sys.argv) > 3 else CORPUS_DIR
+    )
@@ -0,0 +1,416 @@
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from multiprocessing import get_context
+
+from decouple import config, Csv
+
+import bench.corpus as corpus
+from database.archive import Archive
+from py.utils import logger
+import py.utils as u
+
+
+BENCH_DIR = config('BENCH_DIR', default=os.path.join(os.path.dirname(__file__), '..', 'cache', 'bench'))
+BENCH_HISTORY = config('BENCH_HISTORY', default=os.path.join(os.path.dirname(__file__), '..', 'cache', 'bench_history.json'))
+# number of games in each dataset
+BENCH_SIZES = config('BENCH_SIZES', default='1000,10000', cast=Csv(int))
+BENCH_SEED = config('BENCH_SEED', default=0, cast=int)
+# report cases run for that many most active players
+BENCH_PLAYERS = config('BENCH_PLAYERS', default=20, cast=int)
+# a case is slower than the median of the previous runs by more than that share
+BENCH_THRESHOLD = config('BENCH_THRESHOLD', default=0.2, cast=float)
+BENCH_BASELINE_RUNS = config('BENCH_BASELINE_RUNS', default=5, cast=int)
+# the benchmark empties the game tables, so it must point at a separate database
+BENCH_RESET_DB = config('BENCH_RESET_DB', default=False, cast=bool)
+
+
+class Dataset:
+    """Synthetic corpus of a given size, generated on the first use."""
+
+    def __init__(self, size, seed=BENCH_SEED):
+        self.size = size
+        self.directory = os.path.join(BENCH_DIR, f'{size}_{seed}_v{corpus.CORPUS_VERSION}')
+        if not os.path.isdir(os.path.join(self.directory, 'archive')):
+            corpus.generate(size, seed, self.directory, archive=True)
+        self.archive = Archive(os.path.join(self.directory, 'archive'), read_only=True)
+
+    def games(self):
+        return self.archive.games()
+
+    def players(self, n=BENCH_PLAYERS):
+        counts = Counter(player for g, _ in self.games() for player in g['players'])
+        return counts.most_common(n)
+
+
+def reset_db():
+    from sqlalchemy import text
+    from database.db_connect import session, game_tables
+
+    session.execute(text(f'truncate {", ".join(game_tables())}'))
+    session.commit()
+
+
+def load_variants():
+    """Fills the variants table from resources/variants.json with the clue colors used by the corpus,
+    so replays store color names."""
+    from database.db_connect import session, Variant
+    import py.variants as variants
+
+    colors = corpus.variant_colors()
+    existing = {v.variant_id: v for v in session.query(Variant).all()}
+    for v in variants.from_json():
+        if v.variant_id not in existing:
+            session.add(Variant(
+                v.variant_id, v.name, v.max_score, *v.max_scores, list(v.suits), *[None] * 6, colors[v.variant_id],
+                *[None] * 4
+            ))
+        elif not existing[v.variant_id].colors:
+            existing[v.variant_id].colors = colors[v.variant_id]
+    session.commit()
+
+
+def load_dataset(dataset):
+    from database.bulk_load import BulkWriter, count_rows
+    import database.db_load as d
+
+    reset_db()
+    writer = BulkWriter()
+    rows_count = 0
+    for g, s in dataset.games():
+        rows = d.build_rows(g, s)
+        rows_count += count_rows(rows)
+        writer.add(rows)
+    writer.flush()
+    return rows_count
+
+
+def ensure_loaded(dataset):
+    from database.db_connect import session, Game
+
+    load_variants()
+    if session.query(Game).count() != dataset.size:
+        load_dataset(dataset)
+
+
+def replay_args(g, s, colors):
+    """Arguments of replay() for a game, with the clue colors by variant id of the corpus."""
+    import py.variants as variants
+
+    info = variants.get(g['options']['variant'])
+    try:
+        starting_player = g['options']['startingPlayer']
+    except KeyError:
+        starting_player = s['options']['startingPlayer']
+    return (
+        [(c['suitIndex'], c['rank']) for c in g['deck']],
+        [(a['type'], a['target'], a['value']) for a in g['actions']],
+        g['players'],
+        starting_player,
+        info.name,
+        [suit.lower() for suit in info.suits],
+        [c.lower() for c in colors[s['options']['variantID']]]
+    )
+
+
+def prepare_games(dataset):
+    return [g for g, _ in dataset.games()]
+
+
+def run_deck_actions(games):
+    import database.db_load as d
+
+    return sum(len(d.build_deck(g)) + len(d.build_actions(g)) for g in games)
+
+
+def prepare_replay(dataset):
+    colors = corpus.variant_colors()
+    return [replay_args(g, s, colors) for g, s in dataset.games()]
+
+
+def run_replay(args):
+    from database.replay import replay
+
+    rows = 0
+    for a in args:
+        card_actions, clues, _ = replay(*a)
+        rows += len(card_actions) + len(clues)
+    return rows
+
+
+def prepare_slots(dataset):
+    from database.replay import replay
+
+    colors = corpus.variant_colors()
+    return [
+        (replay(*replay_args(g, s, colors))[0], u.get_number_of_cards_in_hand(len(g['players']), False, False))
+        for g, s in dataset.games()
+    ]
+
+
+def run_slots(args):
+    from database.replay import track_slots
+
+    return sum(len(track_slots(card_actions, cards_per_hand)) for card_actions, cards_per_hand in args)
+
+
+def prepare_reports(dataset):
+    ensure_loaded(dataset)
+    return dataset.players()
+
+
+def report_case(report):
+    def run(players):
+        for player, _ in players:
+            report(player)
+        return sum(games_count for _, games_count in players)
+    return run
+
+
+def preference(player):
+    import py.preference as preference_report
+
+    teammates = preference_report.get_teammates(player)
+    preference_report.get_preference(preference_report.get_teammate_win_rate(player, teammates))
+
+
+def fav_suits(player):
+    import py.fav_suits as fav_suits_report
+
+    fav_suits_report.get_suits(player)
+
+
+def end_condition(player):
+    import py.end_condition as end_condition_report
+
+    end_condition_report.count_conditions(player)
+
+
+def time_spent(player):
+    import py.time_spent as time_spent_report
+
+    time_spent_report.get_times(player)
+
+
+def notes(player):
+    import py.notes.notes_per_game as notes_per_game
+    import py.notes.notes_portrait as notes_portrait
+
+    notes_per_game.get_notes_ratio(player)
+    notes_portrait.get_notes_stats(player)
+
+
+def prepare_engine(dataset):
+    ensure_loaded(dataset)
+    return {player for player, _ in dataset.players(None)}, dataset.size
+
+
+def run_engine(args):
+    import py.end_condition as end_condition_report
+    import py.fav_suits as fav_suits_report
+    import py.report_engine as engine
+    import py.starting_player as starting_player_report
+    import py.time_spent as time_spent_report
+
+    users, games_count = args
+    engine.run([
+        end_condition_report.EndConditions(),
+        fav_suits_report.FavSuits(),
+        starting_player_report.StartingPlayer(),
+        time_spent_report.TimeSpent()
+    ], users)
+    return games_count
+
+
+def prepare_store(dataset):
+    ensure_loaded(dataset)
+    return dataset
+
+
+def run_store(dataset):
+    import py.game_store as gs
+
+    return len(gs.build())
+
+
+def prepare_teammates(dataset):
+    import py.game_store as gs
+
+    ensure_loaded(dataset)
+    return gs.build()
+
+
+def run_teammates(store):
+    import py.teammates as tm
+
+    return len(tm.build(store).indices)
+
+
+def prepare_ranks(dataset):
+    import py.game_store as gs
+    import py.rank as rank
+    import py.teammates as tm
+
+    ensure_loaded(dataset)
+    store = gs.build()
+    return tm.build(store, rank.rank_mask(store))
+
+
+def run_ranks(matrix):
+    import py.rank as rank
+
+    rank.calculate_ranks(matrix)
+    return len(matrix.indices)
+
+
+def prepare_load(dataset):
+    load_variants()
+    return dataset
+
+
+# name: (preparation, which is not timed, and the case returning the number of processed rows)
+CASES = {
+    'load': (prepare_load, load_dataset),
+    'deck_actions': (prepare_games, run_deck_actions),
+    'replay': (prepare_replay, run_replay),
+    'slots': (prepare_slots, run_slots),
+    'preference': (prepare_reports, report_case(preference)),
+    'fav_suits': (prepare_reports, report_case(fav_suits)),
+    'end_condition': (prepare_reports, report_case(end_condition)),
+    'time_spent': (prepare_reports, report_case(time_spent)),
+    'notes': (prepare_reports, report_case(notes)),
+    'report_engine': (prepare_engine, run_engine),
+    'game_store': (prepare_store, run_store),
+    'teammates': (prepare_teammates, run_teammates),
+    'rank': (prepare_ranks, run_ranks)
+}
+
+
+def measure(case, dataset, conn):
+    prepare, run = CASES[case]
+    arg = prepare(dataset)
+    # kilobytes on linux, the peak includes the preparation and the memory inherited from the parent
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    rows = run(arg)
+    seconds = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    conn.send((seconds, rows, rss_after / 1024, (rss_after - rss_before) / 1024))
+    conn.close()
+
+
+def run_case(case, dataset):
+    """Runs the case in a forked process, so peak memory is measured for the case alone.
+    The db is used by the forked processes only, so no connection is shared.
+
+    Returns
+    -------
+    dict
+        Seconds, rows, rows/sec, peak RSS and its growth during the timed run in megabytes
+        or None if the case failed
+    """
+    ctx = get_context('fork')
+    parent_conn, child_conn = ctx.Pipe()
+    process = ctx.Process(target=measure, args=(case, dataset, child_conn))
+    process.start()
+    # the pipe reports EOF only once both ends of the child are closed
+    child_conn.close()
+    try:
+        seconds, rows, peak_rss, run_rss = parent_conn.recv()
+    except EOFError:
+        return None
+    finally:
+        process.join()
+    return {
+        'seconds': round(seconds, 4),
+        'rows': rows,
+        'rows_per_sec': u.p1(rows, seconds),
+        'peak_rss_mb': round(peak_rss, 1),
+        'run_rss_mb': round(run_rss, 1)
+    }
+
+
+def open_history(path=BENCH_HISTORY):
+    if not os.path.isfile(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.loads(f.read())
+
+
+def save_history(history, path=BENCH_HISTORY):
+    u.mkdir_p(os.path.dirname(path))
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(history, indent=1))
+
+
+def baseline(history, case, size, runs=BENCH_BASELINE_RUNS):
+    previous = [r['seconds'] for r in history if r['case'] == case and r['size'] == size][-runs:]
+    return statistics.median(previous) if len(previous) != 0 else None
+
+
+def commit_id():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def run(cases=None, sizes=BENCH_SIZES, threshold=BENCH_THRESHOLD):
+    """Runs the cases for every dataset size, appends the results to the history file
+    and flags the cases slower than the median of their previous runs. A failed case does not stop the others.
+
+    Parameters
+    ----------
+    cases : list
+        Case names, all by default
+    sizes : list
+        Numbers of games
+    threshold : float
+        Allowed slowdown as a share of the baseline
+
+    Returns
+    -------
+    tuple
+        Regressions as (case, size, seconds, baseline) and failed cases as (case, size)
+    """
+    if not BENCH_RESET_DB:
+        logger.error('set BENCH_RESET_DB=True with POSTGRES_DB pointing at a database for benchmarks')
+        sys.exit(1)
+    cases = cases or list(CASES)
+    history = open_history()
+    run_date, commit = datetime.now().strftime('%Y-%m-%d %H:%M:%S'), commit_id()
+    regressions, failures = [], []
+    for size in sizes:
+        dataset = Dataset(size)
+        for case in cases:
+            result = run_case(case, dataset)
+            if result is None:
+                logger.error(f'{case} [{size}]: failed')
+                failures.append((case, size))
+                continue
+            previous = baseline(history, case, size)
+            regression = previous is not None and result['seconds'] > previous * (1 + threshold)
+            if regression:
+                regressions.append((case, size, result['seconds'], previous))
+            logger.info(f'{case} [{size}]: {result["seconds"]}s, {result["rows_per_sec"]} rows/sec, '
+                        f'{result["peak_rss_mb"]} MB peak, +{result["run_rss_mb"]} MB in run, baseline: {previous}s{" REGRESSION" if regression else ""}')
+            history.append({'date': run_date, 'commit': commit, 'case': case, 'size': size, **result})
+    save_history(history)
+    return regressions, failures
+
+
+if __name__ == "__main__":
+    # [case ...]: run the given cases only
+    found, failed = run(sys.argv[1:] or None)
+    if len(found) != 0:
+        logger.error(f'regressions: {found}')
+    if len(failed) != 0:
+        logger.error(f'failed: {failed}')
+    if len(found) != 0 or len(failed) != 0:
+        sys.exit(1)
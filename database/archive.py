@@ -0,0 +1,177 @@
+import gzip
+import json
+import os
+import sys
+
+from decouple import config
+
+from py.utils import logger
+import py.utils as u
+
+
+ARCHIVE_DIR = config(
+    'ARCHIVE_DIR',
+    default=os.path.join(os.path.dirname(__file__), '..', 'archive')
+)
+# a new shard is started when the current one exceeds the size in megabytes
+ARCHIVE_SHARD_MB = config('ARCHIVE_SHARD_MB', default=64, cast=int)
+# store raw payloads during ingestion
+ARCHIVE_ENABLED = config('ARCHIVE_ENABLED', default=True, cast=bool)
+
+
+class Archive:
+    """Append-only archive of raw game payloads: the export and the history row of each game.
+
+    Every game is a separate gzip member appended to the current shard, so shards are valid gzip files
+    and any game can be read by seeking to its offset. The index file maps game ids to
+    (shard, offset, length) and is appended after the member is written, so a crash leaves
+    at most an unindexed tail or a partial index line, which are cut off on the next start of a writer.
+    A read-only archive never changes the shards, so it can be opened while a writer appends to them.
+    """
+
+    def __init__(self, directory=ARCHIVE_DIR, shard_size=ARCHIVE_SHARD_MB * 2 ** 20, read_only=False):
+        self.directory = directory
+        self.shard_size = shard_size
+        self.read_only = read_only
+        if not read_only:
+            u.mkdir_p(directory)
+        self.index_path = os.path.join(directory, 'index.tsv')
+        self.index = {}
+        if os.path.isfile(self.index_path):
+            self.read_index()
+        if len(self.index) == 0:
+            self.shard, end = 0, 0
+        else:
+            self.shard, end = max((shard, offset + length) for shard, offset, length in self.index.values())
+        self.file = None
+        if not read_only:
+            self.open_shard(end)
+
+    def read_index(self):
+        """Reads the index file. Malformed lines are skipped, a writer cuts off the ones after the last valid line."""
+        position, end = 0, 0
+        with open(self.index_path, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError('no line end')
+                    game_id, shard, offset, length = map(int, line.decode('utf-8').split('\t'))
+                except ValueError as e:
+                    logger.error(f'malformed line at byte {position} of {self.index_path} skipped: {line[:80]!r} ({e})')
+                    position += len(line)
+                    continue
+                self.index[game_id] = (shard, offset, length)
+                position += len(line)
+                end = position
+        if not self.read_only and end < os.path.getsize(self.index_path):
+            with open(self.index_path, 'r+b') as f:
+                f.truncate(end)
+
+    def shard_path(self, shard):
+        return os.path.join(self.directory, f'shard_{shard:05d}.gz')
+
+    def open_shard(self, end):
+        path = self.shard_path(self.shard)
+        self.file = open(path, 'r+b' if os.path.isfile(path) else 'wb')
+        self.file.truncate(end)
+        self.file.seek(end)
+
+    def __contains__(self, game_id):
+        return game_id in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def append(self, g, s):
+        """Appends the payloads of a game, unless it is archived already.
+
+        Parameters
+        ----------
+        g : dict
+            Game from the export API
+        s : dict
+            The game from a player's history
+        """
+        if g['id'] in self.index:
+            return
+        if self.file.tell() >= self.shard_size:
+            self.file.close()
+            self.shard += 1
+            self.open_shard(0)
+        data = gzip.compress(json.dumps({'game': g, 'stats': s}).encode('utf-8'))
+        offset = self.file.tell()
+        self.file.write(data)
+        self.file.flush()
+        self.index[g['id']] = (self.shard, offset, len(data))
+        with open(self.index_path, 'a', encoding='utf-8') as f:
+            f.write(f'{g["id"]}\t{self.shard}\t{offset}\t{len(data)}\n')
+
+    @staticmethod
+    def decode(data):
+        record = json.loads(gzip.decompress(data))
+        return record['game'], record['stats']
+
+    def get(self, game_id):
+        """Reads the payloads of a game.
+
+        Parameters
+        ----------
+        game_id : int
+            Game id
+
+        Returns
+        -------
+        tuple
+            Game from the export API and the game from a player's history or None
+        """
+        if game_id not in self.index:
+            return None
+        shard, offset, length = self.index[game_id]
+        with open(self.shard_path(shard), 'rb') as f:
+            f.seek(offset)
+            return self.decode(f.read(length))
+
+    def games(self, first_id=0, last_id=None):
+        """Reads archived games in the order they are stored, one shard at a time.
+
+        Parameters
+        ----------
+        first_id : int
+            The first game id
+        last_id : int
+            The last game id, all games by default
+
+        Returns
+        -------
+        generator
+            Game from the export API and the game from a player's history
+        """
+        if self.file is not None:
+            self.file.flush()
+        entries = sorted(
+            position for game_id, position in self.index.items()
+            if game_id >= first_id and (last_id is None or game_id <= last_id)
+        )
+        f, shard = None, None
+        for entry_shard, offset, length in entries:
+            if entry_shard != shard:
+                if f is not None:
+                    f.close()
+                shard = entry_shard
+                f = open(self.shard_path(shard), 'rb')
+            f.seek(offset)
+            yield self.decode(f.read(length))
+        if f is not None:
+            f.close()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+if __name__ == "__main__":
+    archive = Archive(sys.argv[1] if len(sys.argv) > 1 else ARCHIVE_DIR, read_only=True)
+    size = sum(length for _, _, length in archive.index.values())
+    logger.info(f'games: {len(archive)}, shards: {archive.shard + 1}, size: {round(size / 2 ** 20, 1)} MB, '
+                f'ids: {min(archive.index, default=None)} - {max(archive.index, default=None)}')
+    archive.close()
@@ -0,0 +1,179 @@
+import os
+import sys
+import time
+from datetime import datetime
+from multiprocessing import Pool
+
+from decouple import config
+from sqlalchemy import func
+
+from database.db_connect import db, Session, session, Game, Card, GameAction, CardAction, Clue, Slot, BackfillChunk
+from py.utils import logger
+import py.utils as u
+import py.variants as variants
+import database.db_load as d
+
+
+# number of processes, each with its own db connection
+WORKERS = config('BACKFILL_WORKERS', default=os.cpu_count(), cast=int)
+# number of game ids processed in one transaction
+CHUNK_SIZE = config('BACKFILL_CHUNK_SIZE', default=1000, cast=int)
+
+# replay: card actions, clues and slots, slots: slots from stored card actions, is_win: win flag of games
+JOBS = ['replay', 'slots', 'is_win']
+
+worker_session = None
+
+
+def init_worker():
+    global worker_session
+    worker_session = Session()
+
+
+def group_by(rows, key):
+    groups = {}
+    for row in rows:
+        groups.setdefault(getattr(row, key), []).append(row)
+    return groups
+
+
+def in_chunk(column, chunk_start, chunk_end):
+    return column.between(chunk_start, chunk_end - 1)
+
+
+def delete_derived(s, tables, games):
+    game_ids = [g.game_id for g in games]
+    for table in tables:
+        s.query(table).filter(table.game_id.in_(game_ids)).delete(synchronize_session=False)
+
+
+def replay_chunk(s, games, chunk_start, chunk_end):
+    delete_derived(s, [Slot, Clue, CardAction], games)
+    actions = group_by(s.query(GameAction).filter(in_chunk(GameAction.game_id, chunk_start, chunk_end)).all(), 'game_id')
+    decks = group_by(s.query(Card).filter(Card.seed.in_(list({g.seed for g in games}))).all(), 'seed')
+    card_actions_res, clues_res, slots_res = [], [], []
+    for g in games:
+        if g.detrimental_characters:
+            continue
+        card_actions, clues = d.build_card_actions_and_clues(g, actions.get(g.game_id, []), decks.get(g.seed, []))
+        card_actions_res += card_actions
+        clues_res += clues
+        slots_res += d.build_slots(g, card_actions)
+    # card actions have to be inserted before the slots referencing them
+    s.bulk_save_objects(card_actions_res + clues_res + slots_res)
+
+
+def slots_chunk(s, games, chunk_start, chunk_end):
+    delete_derived(s, [Slot], games)
+    card_actions = group_by(s.query(CardAction).filter(in_chunk(CardAction.game_id, chunk_start, chunk_end)).all(), 'game_id')
+    slots_res = []
+    for g in games:
+        slots_res += d.build_slots(g, card_actions.get(g.game_id, []))
+    s.bulk_save_objects(slots_res)
+
+
+def is_win_chunk(games):
+    for g in games:
+        g.is_win = variants.is_win(g.score, g.variant_id)
+
+
+def process_chunk(chunk):
+    """Rebuilds derived tables for the games of a chunk and marks the chunk as finished in the same transaction.
+
+    Parameters
+    ----------
+    chunk : tuple
+        Job, first game id and the id after the last one
+
+    Returns
+    -------
+    tuple
+        First game id and number of processed games
+    """
+    job, chunk_start, chunk_end = chunk
+    s = worker_session
+    games = s.query(Game) \
+        .filter(in_chunk(Game.game_id, chunk_start, chunk_end)) \
+        .filter(Game.num_players != None) \
+        .all()
+    skipped = [g.game_id for g in games if variants.get(g.variant_id) is None]
+    if len(skipped) != 0:
+        logger.error(f'unknown variant: {skipped}')
+    games = [g for g in games if g.game_id not in skipped]
+    if job == 'replay':
+        replay_chunk(s, games, chunk_start, chunk_end)
+    elif job == 'slots':
+        slots_chunk(s, games, chunk_start, chunk_end)
+    else:
+        is_win_chunk(games)
+    s.merge(BackfillChunk(job, chunk_start, chunk_end, len(games), datetime.now()))
+    s.commit()
+    return chunk_start, len(games)
+
+
+def pending_chunks(job, chunk_size=CHUNK_SIZE):
+    """Splits the games id space into chunks and removes the ones finished by a previous run.
+
+    Parameters
+    ----------
+    job : str
+        Job name
+    chunk_size : int
+        Number of game ids in a chunk
+
+    Returns
+    -------
+    list
+        Chunks as (job, first game id, the id after the last one)
+    """
+    first_id, last_id = session.query(func.min(Game.game_id), func.max(Game.game_id)).first()
+    if first_id is None:
+        return []
+    finished = session.query(BackfillChunk.chunk_start).filter(BackfillChunk.job == job).all()
+    finished = {c[0] for c in finished}
+    return [
+        (job, chunk_start, chunk_start + chunk_size)
+        for chunk_start in range(first_id - first_id % chunk_size, last_id + 1, chunk_size)
+        if chunk_start not in finished
+    ]
+
+
+def restart(job):
+    """Forgets the finished chunks of the job, so the next run processes all games again."""
+    deleted = session.query(BackfillChunk).filter(BackfillChunk.job == job).delete(synchronize_session=False)
+    session.commit()
+    logger.info(f'{job}: {deleted} finished chunks forgotten')
+
+
+def backfill(job, workers=WORKERS, chunk_size=CHUNK_SIZE):
+    chunks = pending_chunks(job, chunk_size)
+    logger.info(f'{job}: {len(chunks)} chunks to process with {workers} workers')
+    # connections must not be shared with the forked workers
+    session.close()
+    db.dispose()
+    start_time = time.monotonic()
+    games_count = 0
+    with Pool(workers, initializer=init_worker) as pool:
+        for i, (chunk_start, chunk_games) in enumerate(pool.imap_unordered(process_chunk, chunks), start=1):
+            games_count += chunk_games
+            seconds = time.monotonic() - start_time
+            eta = u.convert_sec_to_day(seconds / i * (len(chunks) - i))
+            logger.info(f'{job}: chunk {chunk_start} done, {i}/{len(chunks)} chunks, '
+                        f'{u.p1(games_count, seconds)} games/sec, '
+                        f'eta: {eta["days"]}d {eta["hours"]}h {eta["minutes"]}m {eta["seconds"]}s')
+    return games_count
+
+
+if __name__ == "__main__":
+    # [job] [--restart]: run the job, with --restart also over the chunks finished by previous runs
+    args = [arg for arg in sys.argv[1:] if arg != '--restart']
+    backfill_job = args[0] if len(args) > 0 else 'replay'
+    if backfill_job not in JOBS:
+        logger.error(f'unknown job: {backfill_job}, expected one of {JOBS}')
+        sys.exit(1)
+    if backfill_job == 'replay' and variants.VARIANTS_SOURCE == 'json':
+        logger.error('replay needs the clue colors of the variants table, set VARIANTS_SOURCE=db')
+        sys.exit(1)
+    if '--restart' in sys.argv:
+        restart(backfill_job)
+    backfill(backfill_job)
@@ -0,0 +1,210 @@
+import io
+import sys
+import time
+
+from decouple import config
+
+from database.db_connect import session, Game, Card, GameAction, PlayerNotes, Tag, CardAction, Clue, Slot
+from py.utils import logger
+import py.utils as u
+import database.db_load as d
+import database.metrics as me
+
+
+# number of games accumulated before the rows are written
+BATCH_SIZE = config('BULK_BATCH_SIZE', default=500, cast=int)
+# copy or executemany
+BULK_METHOD = config('BULK_METHOD', default='copy')
+
+# insertion order respects the foreign keys to games
+TABLES = [
+    ('game', Game),
+    ('deck', Card),
+    ('actions', GameAction),
+    ('notes', PlayerNotes),
+    ('tags', Tag),
+    ('card_actions', CardAction),
+    ('clues', Clue),
+    ('slots', Slot)
+]
+
+
+def escape_copy(value):
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def array_item(value):
+    if value is None:
+        return 'NULL'
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def copy_value(value):
+    """Converts a value into PostgreSQL COPY text format."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (list, tuple)):
+        return escape_copy('{' + ','.join(array_item(v) for v in value) + '}')
+    return escape_copy(str(value))
+
+
+def to_row(obj):
+    return [getattr(obj, c.name) for c in obj.__table__.columns]
+
+
+class BulkWriter:
+    """Accumulates rows of many games and writes them into the db in one go.
+
+    Games, decks, actions, notes, tags and the replayed card actions, clues and slots
+    are loaded with COPY (or a multi-row executemany). The session is committed once per batch.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, method=BULK_METHOD):
+        self.batch_size = batch_size
+        self.method = method
+        self.games = []
+        self.rows = {key: [] for key, _ in TABLES}
+        self.seeds = set()
+        self.rows_written = 0
+
+    def add(self, rows):
+        db_game = rows['game']
+        self.games.append((db_game, rows['actions'], rows['deck']))
+        self.rows['game'].append(db_game)
+        if db_game.seed not in self.seeds:
+            self.seeds.add(db_game.seed)
+            self.rows['deck'] += rows['deck']
+        for key in ['actions', 'notes', 'tags']:
+            self.rows[key] += rows[key]
+        if len(self.games) >= self.batch_size:
+            self.flush()
+
+    def existing_seeds(self):
+        seeds = session.query(Card.seed).distinct().filter(Card.seed.in_(list(self.seeds))).all()
+        return {s[0] for s in seeds}
+
+    def copy(self, table, objects):
+        buffer = io.StringIO()
+        for obj in objects:
+            buffer.write('\t'.join(copy_value(v) for v in to_row(obj)) + '\n')
+        buffer.seek(0)
+        columns = ', '.join(c.name for c in table.columns)
+        cursor = session.connection().connection.cursor()
+        cursor.copy_expert(f'COPY {table.name} ({columns}) FROM STDIN', buffer)
+        cursor.close()
+
+    def executemany(self, table, objects):
+        session.execute(table.insert(), [{c.name: getattr(obj, c.name) for c in table.columns} for obj in objects])
+
+    def write(self):
+        existing = self.existing_seeds()
+        self.rows['deck'] = [card for card in self.rows['deck'] if card.seed not in existing]
+        for key, model in TABLES:
+            objects = self.rows[key]
+            if len(objects) == 0:
+                continue
+            if self.method == 'copy':
+                self.copy(model.__table__, objects)
+            else:
+                self.executemany(model.__table__, objects)
+            self.rows_written += len(objects)
+            me.get_metrics().count_rows(model.__tablename__, len(objects))
+
+    def add_replay(self):
+        for db_game, game_actions, deck in self.games:
+            if db_game.detrimental_characters:
+                continue
+            card_actions, clues = d.build_card_actions_and_clues(db_game, game_actions, deck)
+            self.rows['card_actions'] += card_actions
+            self.rows['clues'] += clues
+            self.rows['slots'] += d.build_slots(db_game, card_actions)
+
+    def flush(self, commit=True):
+        if len(self.games) == 0:
+            return
+        metrics = me.get_metrics()
+        with metrics.time('replay'):
+            self.add_replay()
+        with metrics.time('copy'):
+            self.write()
+        if commit:
+            with metrics.time('commit'):
+                session.commit()
+        logger.info(f'flushed {len(self.games)} games, last id: {self.games[-1][0].game_id}')
+        self.games = []
+        self.rows = {key: [] for key, _ in TABLES}
+        self.seeds = set()
+
+
+def count_rows(rows):
+    return 1 + len(rows['deck']) + len(rows['actions']) + len(rows['notes']) + len(rows['tags'])
+
+
+def shift(g, s, offset):
+    """Moves a game to an unused id and seed, so that it can be inserted next to the original one."""
+    g = {**g, 'id': g['id'] + offset, 'seed': f'{g["seed"]}_{offset}'}
+    s = {**s, 'id': s['id'] + offset}
+    return g, s
+
+
+def benchmark(games, offset=10 ** 9):
+    """Compares rows/sec of the ORM loader, executemany and COPY on the same games.
+
+    Every method writes into the db inside a transaction which is rolled back afterwards.
+
+    Parameters
+    ----------
+    games : list
+        Pairs of exported game and its history row
+    offset : int
+        Added to the game ids to avoid conflicts with the stored games
+
+    Returns
+    -------
+    dict
+        Rows/sec grouped by method
+    """
+    rows_count = sum(count_rows(d.build_rows(*shift(g, s, offset))) for g, s in games)
+    results = {}
+    for method in ['orm', 'executemany', 'copy']:
+        start = time.perf_counter()
+        if method == 'orm':
+            for g, s in games:
+                g, s = shift(g, s, offset)
+                d.load_deck(g)
+                d.load_game(g, s)
+                d.load_actions(g)
+                d.load_notes(g)
+                d.load_tags(s)
+                session.flush()
+        else:
+            writer = BulkWriter(batch_size=len(games) + 1, method=method)
+            for g, s in games:
+                writer.add(d.build_rows(*shift(g, s, offset)))
+            writer.write()
+            session.flush()
+        seconds = time.perf_counter() - start
+        session.rollback()
+        results[method] = u.p1(rows_count, seconds)
+        logger.info(f'{method}: {rows_count} rows in {round(seconds, 2)}s ({results[method]} rows/sec)')
+    return results
+
+
+if __name__ == "__main__":
+    import database.migration as m
+    from py.history_cache import HistoryCache
+
+    first_id, last_id = int(sys.argv[1]), int(sys.argv[2])
+    req_session = m.init_req_session()
+    histories = HistoryCache(req_session, min_game_id=first_id)
+    bench_games = []
+    for g_id, g in m.fetch_games(first_id, req_session):
+        if g == {} or g_id > last_id:
+            break
+        s = m.get_stats(g, histories) if len(g['players']) != 0 else None
+        if s is not None:
+            bench_games.append((g, s))
+    benchmark(bench_games)
+    session.close()
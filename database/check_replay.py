@@ -0,0 +1,157 @@
+import json
+import sys
+
+from sqlalchemy import func
+
+from database.db_connect import session, Game, Card, GameAction, CardAction, Clue
+from py.utils import logger
+import py.utils as u
+import database.db_load as d
+
+
+def stored_card_actions(game_id):
+    card_actions = session.query(CardAction) \
+        .filter(CardAction.game_id == game_id) \
+        .order_by(CardAction.card_index) \
+        .all()
+    return [[c.card_suit, c.card_rank, c.player, c.turn_drawn, c.action_type, c.turn_action] for c in card_actions]
+
+
+def stored_clues(game_id):
+    clues = session.query(Clue) \
+        .filter(Clue.game_id == game_id) \
+        .order_by(Clue.turn_clued) \
+        .all()
+    return [[c.turn_clued, c.clue, c.clue_type, c.clue_giver, c.clue_receiver] for c in clues]
+
+
+def check_game(game_id):
+    """Compares replayed card actions and clues of the game with the stored ones.
+
+    Parameters
+    ----------
+    game_id : int
+        Game id
+
+    Returns
+    -------
+    bool
+        A flag representing whether the replay matches the db
+    """
+    db_game = session.get(Game, game_id)
+    if db_game is None or db_game.detrimental_characters:
+        return True
+    game_actions = session.query(GameAction).filter(GameAction.game_id == game_id).all()
+    deck = session.query(Card).filter(Card.seed == db_game.seed).all()
+    card_actions, clues, _ = d.replay_game(db_game, game_actions, deck)
+    # clue values are stored as strings
+    clues = [[c[0], str(c[1]), *c[2:]] for c in clues]
+    ok = True
+    if card_actions != stored_card_actions(game_id):
+        logger.error(f'{game_id}: card actions differ')
+        ok = False
+    if clues != stored_clues(game_id):
+        logger.error(f'{game_id}: clues differ')
+        ok = False
+    return ok
+
+
+def legacy_slots(card_actions, len_cards):
+    """Calculates slots with the previous algorithm, which rescans all card actions for every played card.
+
+    Parameters
+    ----------
+    card_actions : list
+        Card actions of the game
+    len_cards : int
+        Number of cards in each starting hand
+
+    Returns
+    -------
+    list
+        Slot movements as (card index, turn, slot)
+    """
+    card_actions = sorted([ca for ca in card_actions if ca.turn_drawn is not None], key=lambda x: x.card_index)
+    card_actions_copy = list(card_actions)
+    slots = []
+    for ca in card_actions:
+        if ca.turn_drawn == 0:
+            slot = len_cards - ca.card_index % len_cards
+        else:
+            slot = 1
+        slots.append((ca.card_index, ca.turn_drawn, slot))
+    card_actions = [ca for ca in card_actions if ca.turn_action is not None]
+    for ca in sorted(card_actions, key=lambda x: x.turn_action):
+        card_slot = max([s[2] for s in slots if s[0] == ca.card_index])
+        len_drawn_cards = len([
+            a for a in card_actions_copy if
+            a.turn_drawn >= ca.turn_drawn and
+            a.player == ca.player and
+            a.card_index != ca.card_index and
+            (a.turn_action is None or
+             a.turn_action > ca.turn_action)
+        ])
+        len_moved_cards = min(len_drawn_cards, card_slot - 1)
+        card_actions_filtered = sorted([
+            a for a in card_actions_copy if
+            a.turn_drawn < ca.turn_action and
+            a.player == ca.player and
+            a.card_index != ca.card_index and
+            (a.turn_action is None or
+             a.turn_action > ca.turn_action)
+        ], key=lambda x: -x.card_index)[:len_moved_cards]
+        for i in card_actions_filtered:
+            moved_card_slot = max([s[2] for s in slots if s[0] == i.card_index])
+            slots.append((i.card_index, ca.turn_action, moved_card_slot + 1))
+    return slots
+
+
+def check_slots(game_id):
+    """Compares slots of the hand tracker with the previous algorithm for a stored game.
+
+    Parameters
+    ----------
+    game_id : int
+        Game id
+
+    Returns
+    -------
+    bool
+        A flag representing whether both algorithms give the same slots
+    """
+    db_game = session.get(Game, game_id)
+    card_actions = session.query(CardAction).filter(CardAction.game_id == game_id).all()
+    len_cards = u.get_number_of_cards_in_hand(db_game.num_players, db_game.one_less_card, db_game.one_extra_card)
+    tracked = sorted((s.card_index, s.turn, s.slot) for s in d.build_slots(db_game, card_actions))
+    legacy = sorted(legacy_slots(card_actions, len_cards))
+    if tracked != legacy:
+        logger.error(f'{game_id}: slots differ, only tracked: {sorted(set(tracked) - set(legacy))}, '
+                     f'only legacy: {sorted(set(legacy) - set(tracked))}')
+        return False
+    return True
+
+
+def sample_game_ids(n):
+    game_ids = session.query(Game.game_id) \
+        .filter(Game.detrimental_characters.is_(False)) \
+        .order_by(func.random()) \
+        .limit(n) \
+        .all()
+    return [g[0] for g in game_ids]
+
+
+if __name__ == "__main__":
+    # slots [sample size]: compare slots on random stored games
+    if len(sys.argv) > 1 and sys.argv[1] == 'slots':
+        game_ids = sample_game_ids(int(sys.argv[2]) if len(sys.argv) > 2 else 1000)
+        failed = [g_id for g_id in game_ids if not check_slots(g_id)]
+        logger.info(f'checked: {len(game_ids)}, failed: {len(failed)}')
+        session.close()
+        sys.exit()
+    # games in json lines format, input/games_test.txt by default
+    filename = sys.argv[1] if len(sys.argv) > 1 else '../input/games_test.txt'
+    with open(filename, 'r', encoding='utf-8') as f:
+        game_ids = [json.loads(line)['id'] for line in f if line.strip() != '']
+    failed = [g_id for g_id in game_ids if not check_game(g_id)]
+    logger.info(f'checked: {len(game_ids)}, failed: {len(failed)}')
+    session.close()
@@ -5,6 +5,8 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import Column, String, Integer, ForeignKey, Boolean, DateTime
 from sqlalchemy.types import ARRAY
 
+import database.profiler as profiler
+
 db_name = config('POSTGRES_DB')
 db_user = config('POSTGRES_USER')
 db_pass = config('POSTGRES_PASSWORD')
@@ -13,6 +15,8 @@ db_port = config('POSTGRES_PORT')
 
 db_string = 'postgresql://{}:{}@{}:{}/{}'.format(db_user, db_pass, db_host, db_port, db_name)
 db = create_engine(db_string)
+# statement counts, latency and plans of slow queries are reported on exit with SQL_PROFILE=True
+profiler.enable(db)
 Session = sessionmaker(bind=db)
 Base = declarative_base()
 
@@ -55,11 +59,13 @@ class Game(Base):
     tags = Column(String)
     seed = Column(String)
     eff = Column(Float)
+    # null if the variant is unknown
+    is_win = Column(Boolean)
 
     def __init__(self, game_id, num_players, players, starting_player, variant_id, variant, timed, time_base,
                  time_per_turn, speedrun, card_cycle, deck_plays, empty_clues, one_extra_card, one_less_card,
                  all_or_nothing, detrimental_characters, score, num_turns, end_condition, date_time_started,
-                 date_time_finished, num_games_on_this_seed, tags, seed, eff):
+                 date_time_finished, num_games_on_this_seed, tags, seed, eff, is_win=None):
         self.game_id = game_id
         self.num_players = num_players
         self.players = players
@@ -86,6 +92,7 @@ class Game(Base):
         self.tags = tags
         self.seed = seed
         self.eff = eff
+        self.is_win = is_win
 
 
 class Card(Base):
@@ -289,6 +296,50 @@ class Tag(Base):
         self.tag = tag
 
 
+class BackfillChunk(Base):
+    __tablename__ = 'backfill_chunks'
+    job = Column(String, primary_key=True)
+    chunk_start = Column(Integer, primary_key=True)
+    chunk_end = Column(Integer)
+    games = Column(Integer)
+    date_time_finished = Column(DateTime)
+
+    def __init__(self, job, chunk_start, chunk_end, games, date_time_finished):
+        self.job = job
+        self.chunk_start = chunk_start
+        self.chunk_end = chunk_end
+        self.games = games
+        self.date_time_finished = date_time_finished
+
+
+class ScanCursor(Base):
+    __tablename__ = 'scan_cursors'
+    name = Column(String, primary_key=True)
+    last_id = Column(Integer)
+    head_id = Column(Integer)
+    date_time_updated = Column(DateTime)
+
+    def __init__(self, name, last_id, head_id, date_time_updated):
+        self.name = name
+        self.last_id = last_id
+        self.head_id = head_id
+        self.date_time_updated = date_time_updated
+
+
+class SkippedGame(Base):
+    __tablename__ = 'skipped_games'
+    game_id = Column(Integer, primary_key=True)
+    reason = Column(String)
+    attempts = Column(Integer)
+    date_time_updated = Column(DateTime)
+
+    def __init__(self, game_id, reason, attempts, date_time_updated):
+        self.game_id = game_id
+        self.reason = reason
+        self.attempts = attempts
+        self.date_time_updated = date_time_updated
+
+
 class H(Base):
     __tablename__ = 'hyphen_ated'
     player = Column(String, primary_key=True)
@@ -297,6 +348,16 @@ class H(Base):
         self.player = player
 
 
+# tables filled from the game payloads, see db_load.build_rows
+GAME_MODELS = [Game, Card, GameAction, PlayerNotes, Tag, CardAction, Clue, Slot]
+
+
+def game_tables():
+    """Names of the tables filled from the game payloads, the referencing tables first."""
+    tables = {model.__table__ for model in GAME_MODELS}
+    return [table.name for table in reversed(Base.metadata.sorted_tables) if table in tables]
+
+
 Base.metadata.create_all(db)
 session = Session()
 session.commit()
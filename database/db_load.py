@@ -1,31 +1,19 @@
-import copy
-
-from sqlalchemy import and_
-
 import py.utils as u
+import py.variants as variants
 from py.utils import logger
+from database.replay import replay, track_slots
 from database.db_connect import session, Game, Card, GameAction,\
     PlayerNotes, Variant, CardAction, Clue, Player, Slot, Tag
 
 
-def load_game(g, s):
+def build_game(g, s):
     g_id = g['id']
     opt = s['options']
     try:
         starting_player = g['options']['startingPlayer']
     except KeyError:
         starting_player = opt['startingPlayer']
-    num = opt['numPlayers']
-    var_eff = None
-    if num == 2:
-        var_eff = session.query(Variant.eff_2p).filter(Variant.variant == opt['variantName']).scalar()
-    elif num in [3, 4]:
-        var_eff = session.query(Variant.eff_34p).filter(Variant.variant == opt['variantName']).scalar()
-    elif num == 5:
-        var_eff = session.query(Variant.eff_5p).filter(Variant.variant == opt['variantName']).scalar()
-    elif num == 6:
-        var_eff = session.query(Variant.eff_6p).filter(Variant.variant == opt['variantName']).scalar()
-    game = Game(
+    return Game(
         g_id,
         opt['numPlayers'],
         g['players'],
@@ -51,19 +39,19 @@ def load_game(g, s):
         s['numGamesOnThisSeed'],
         s['tags'],
         g['seed'],
-        var_eff
+        variants.get_eff(opt['variantName'], opt['numPlayers']),
+        variants.is_win(s['score'], opt['variantID'])
     )
+
+
+def load_game(g, s):
+    game = build_game(g, s)
     session.add(game)
     return game
 
 
-def load_deck(g):
+def build_deck(g):
     deck = g['deck']
-    deck_res = session.query(Card) \
-        .filter(Card.seed == g['seed'])\
-        .all()
-    if len(deck_res) != 0:
-        return deck_res
     deck_res = []
     for i in range(len(deck)):
         card = Card(
@@ -72,12 +60,23 @@ def load_deck(g):
             deck[i]['suitIndex'],
             deck[i]['rank']
         )
-        session.add(card)
         deck_res.append(card)
     return deck_res
 
 
-def load_actions(g):
+def load_deck(g, deck_res=None):
+    deck_db = session.query(Card) \
+        .filter(Card.seed == g['seed'])\
+        .all()
+    if len(deck_db) != 0:
+        return deck_db
+    if deck_res is None:
+        deck_res = build_deck(g)
+    session.add_all(deck_res)
+    return deck_res
+
+
+def build_actions(g):
     g_id = g['id']
     actions = g['actions']
     actions_res = []
@@ -89,13 +88,19 @@ def load_actions(g):
             actions[i]['target'],
             actions[i]['value'],
         )
-        session.add(action)
         actions_res.append(action)
     return actions_res
 
 
-def load_notes(g):
+def load_actions(g):
+    actions_res = build_actions(g)
+    session.add_all(actions_res)
+    return actions_res
+
+
+def build_notes(g):
     g_id = g['id']
+    notes_res = []
     try:
         game_notes = g['notes']
         for i in range(len(game_notes)):
@@ -104,9 +109,25 @@ def load_notes(g):
                 g['players'][i],
                 game_notes[i]
             )
-            session.add(player_notes)
+            notes_res.append(player_notes)
     except KeyError:
-        return
+        pass
+    return notes_res
+
+
+def load_notes(g):
+    session.add_all(build_notes(g))
+
+
+def build_rows(g, s):
+    return {
+        'g': g,
+        'deck': build_deck(g),
+        'game': build_game(g, s),
+        'actions': build_actions(g),
+        'notes': build_notes(g),
+        'tags': build_tags(s)
+    }
 
 
 def update_game(s):
@@ -142,6 +163,7 @@ def update_game(s):
     game.date_time_finished = s['datetimeFinished']
     game.num_games_on_this_seed = s['numGamesOnThisSeed']
     game.tags = s['tags']
+    game.is_win = variants.is_win(s['score'], opt['variantID'])
     return 1
 
 
@@ -172,189 +194,74 @@ def load_game_empty(g):
     session.add(game)
 
 
-def init_piles(variant, suits):
-    if 'Up or Down' in variant:
-        piles = [[0, '']] * u.get_number_of_suits(variant)
-    else:
-        piles = [[0, 'up']] * u.get_number_of_suits(variant)
-        if 'Reversed' in variant:
-            piles[len(suits) - 1] = [6, 'down']
-    return piles
-
-
-def load_card_action_empty(deck, game_id, suits):
-    for card in deck:
-        new_card_action = CardAction(
-            card.card_index,
-            game_id,
-            suits[card.suit_index],
-            card.rank,
-            *[None] * 4
-        )
-        session.add(new_card_action)
-
-
-def init_hands(current_card_ind, players_orig, cards_per_hand, game_id):
-    for i in range(current_card_ind):
-        player = players_orig[i // cards_per_hand]
-        card_action = session.query(CardAction)\
-            .filter(CardAction.game_id == game_id)\
-            .filter(CardAction.card_index == i)\
-            .first()
-        card_action.player = player
-        card_action.turn_drawn = 0
-
-
-def create_clue(action, colors, game_id, num_players, players_mod, players_orig):
-    # color
-    if action.action_type == 2:
-        value = colors[action.value]
-    # rank
-    else:
-        value = action.value
-    clue = Clue(
-        action.turn + 1,
-        game_id,
-        value,
-        'color' if action.action_type == 2 else 'rank',
-        players_mod[action.turn % num_players],
-        players_orig[action.target]
+# variants without clue colors which were already reported
+variants_without_colors = set()
+
+
+def replay_game(db_game, game_actions, deck):
+    variant_info = variants.get(db_game.variant_id)
+    if len(variant_info.colors) == 0 and variant_info.variant_id not in variants_without_colors:
+        variants_without_colors.add(variant_info.variant_id)
+        # resources/variants.json has no colors, a color clue would be stored as its index
+        logger.error(f'no clue colors for variant {variant_info.name} (VARIANTS_SOURCE={variants.VARIANTS_SOURCE}), '
+                     f'color clues are stored as color indices')
+    return replay(
+        [(c.suit_index, c.rank) for c in sorted(deck, key=lambda c: c.card_index)],
+        [(a.action_type, a.target, a.value) for a in sorted(game_actions, key=lambda a: a.turn)],
+        db_game.players,
+        db_game.starting_player,
+        db_game.variant,
+        [s.lower() for s in variant_info.suits],
+        [c.lower() for c in variant_info.colors],
+        db_game.one_less_card,
+        db_game.one_extra_card
     )
-    session.add(clue)
 
 
-def init_action_type(action, suits, card_action, piles):
-    if action.action_type == 0:
-        card_suit_ind = suits.index(card_action.card_suit)
-        if not u.is_played(piles, card_suit_ind, card_action.card_rank):
-            card_action.action_type = 'misplay'
-        else:
-            card_action.action_type = 'play'
-            piles[card_suit_ind] = [
-                card_action.card_rank,
-                u.up_or_down_direction(piles, card_suit_ind, card_action.card_rank)
-            ]
-    elif action.action_type == 1:
-        card_action.action_type = 'discard'
-    return card_action
+def build_card_actions_and_clues(db_game, game_actions, deck):
+    game_id = db_game.game_id
+    card_actions, clues, _ = replay_game(db_game, game_actions, deck)
+    card_actions_res = [CardAction(i, game_id, *card_action) for i, card_action in enumerate(card_actions)]
+    clues_res = [Clue(clue[0], game_id, *clue[1:]) for clue in clues]
+    return card_actions_res, clues_res
 
 
 def load_card_actions_and_clues(db_game, game_actions, deck):
-    game_id = db_game.game_id
-    players_orig = db_game.players
-    num_players = db_game.num_players
-    variant_id = db_game.variant_id
-    variant = db_game.variant
-    starting_player = db_game.starting_player
-    one_less_card = db_game.one_less_card
-    one_extra_card = db_game.one_extra_card
-
-    players_mod = (players_orig[starting_player:] + players_orig[:starting_player])
-
-    suits, colors = session.query(Variant.suits, Variant.colors).filter(Variant.variant_id == variant_id).first()
-    suits = [s.lower() for s in suits]
-    colors = [c.lower() for c in colors]
-    piles = init_piles(variant, suits)
-
-    load_card_action_empty(deck, game_id, suits)
-    current_card_ind = u.get_number_of_starting_cards(num_players, one_less_card, one_extra_card)
-    cards_per_hand = u.get_number_of_cards_in_hand(num_players, one_less_card, one_extra_card)
-    init_hands(current_card_ind, players_orig, cards_per_hand, game_id)
-
-    card_actions = session.query(CardAction).filter(CardAction.game_id == game_id).all()
-
-    for action in game_actions:
-        if action.action_type == 4:
-            return
-        elif u.is_clued(action):
-            create_clue(action, colors, game_id, num_players, players_mod, players_orig)
-        elif action.action_type in [0, 1]:
-            card_action = [c for c in card_actions if c.card_index == action.target][0]
-            card_action = init_action_type(action, suits, card_action, piles)
-            card_action.turn_action = action.turn + 1
-            if current_card_ind == len(deck):
-                continue
-            next_card_action = [c for c in card_actions if c.card_index == current_card_ind][0]
-            next_card_action.turn_drawn = action.turn + 1
-            next_card_action.player = players_mod[action.turn % num_players]
-            current_card_ind += 1
+    card_actions, clues = build_card_actions_and_clues(db_game, game_actions, deck)
+    # the game has to be written before its card actions
+    session.flush()
+    session.bulk_save_objects(card_actions + clues)
+    return card_actions, clues
 
 
 def update_action_types(db_game):
-    game_id, variant = db_game.game_id, db_game.variant
+    game_id = db_game.game_id
     actions = session.query(GameAction).filter(GameAction.game_id == game_id).all()
-    suits = session.query(Variant.suits).filter(Variant.variant == variant).scalar()
-    suits = [s.lower() for s in suits]
-    piles = init_piles(variant, suits)
-    card_actions = session.query(CardAction).filter(CardAction.game_id == game_id).all()
-
-    for action in actions:
-        if action.action_type in [0, 1]:
-            card_action = [c for c in card_actions if c.card_index == action.target][0]
-            init_action_type(action, suits, card_action, piles)
+    deck = session.query(Card).filter(Card.seed == db_game.seed).all()
+    card_actions, _, _ = replay_game(db_game, actions, deck)
+    for card_action in session.query(CardAction).filter(CardAction.game_id == game_id).all():
+        card_action.action_type = card_actions[card_action.card_index][4]
 
 
 def load_player(player):
     session.add(Player(player))
 
 
-def add_slot(card_action, turn, slot):
-    movement = Slot(
-        card_action.game_id,
-        card_action.card_index,
-        turn,
-        slot)
-    session.add(movement)
-    return movement
-
-
-def load_slots(g):
-    card_actions = session.query(
-        CardAction.card_index,
-        CardAction.player,
-        CardAction.turn_drawn,
-        CardAction.turn_action,
-        CardAction.game_id
-    ) \
-        .filter(
-        and_(
-            CardAction.game_id == g.game_id,
-            CardAction.turn_drawn != None
-        )) \
-        .order_by(CardAction.card_index) \
-        .all()
-    card_actions_copy = copy.deepcopy(card_actions)
-    len_cards = u.get_number_of_cards_in_hand(g.num_players, g.one_less_card, g.one_extra_card)
-    slots = []
-    for ca in card_actions:
-        if ca.turn_drawn == 0:
-            slot = len_cards - ca.card_index % len_cards
-        else:
-            slot = 1
-        slots.append(add_slot(ca, ca.turn_drawn, slot))
-    card_actions = [ca for ca in card_actions if ca.turn_action is not None]
-    for ca in sorted(card_actions, key=lambda x: x.turn_action):
-        card_slot = max([s.slot for s in slots if s.card_index == ca.card_index])
-        len_drawn_cards = len([
-            a for a in card_actions_copy if
-            a.turn_drawn >= ca.turn_drawn and
-            a.player == ca.player and
-            a.card_index != ca.card_index and
-            (a.turn_action is None or
-             a.turn_action > ca.turn_action)
-        ])
-        len_moved_cards = min(len_drawn_cards, card_slot - 1)
-        card_actions_filtered = sorted([
-            a for a in card_actions_copy if
-            a.turn_drawn < ca.turn_action and
-            a.player == ca.player and
-            a.card_index != ca.card_index and
-            (a.turn_action is None or
-             a.turn_action > ca.turn_action)
-        ], key=lambda x: -x.card_index)[:len_moved_cards]
-        for i in card_actions_filtered:
-            moved_card_slot = max([s.slot for s in slots if s.card_index == i.card_index])
-            slots.append(add_slot(i, ca.turn_action, moved_card_slot + 1))
+def build_slots(db_game, card_actions):
+    cards_per_hand = u.get_number_of_cards_in_hand(db_game.num_players, db_game.one_less_card, db_game.one_extra_card)
+    card_actions = [
+        [c.card_suit, c.card_rank, c.player, c.turn_drawn, c.action_type, c.turn_action]
+        for c in sorted(card_actions, key=lambda c: c.card_index)
+    ]
+    return [Slot(db_game.game_id, *slot) for slot in track_slots(card_actions, cards_per_hand)]
+
+
+def load_slots(g, card_actions=None):
+    if card_actions is None:
+        card_actions = session.query(CardAction).filter(CardAction.game_id == g.game_id).all()
+    slots = build_slots(g, card_actions)
+    session.bulk_save_objects(slots)
+    return slots
 
 
 def update_tags(s):
@@ -364,7 +271,8 @@ def update_tags(s):
     return 1
 
 
-def load_tags(s):
+def build_tags(s):
+    tags_res = []
     for user_tag in s['users_tags']:
         items = list(user_tag.items())
         user, tag = items[0][0], items[0][1]
@@ -373,4 +281,9 @@ def load_tags(s):
             user,
             tag
         )
-        session.add(tag)
+        tags_res.append(tag)
+    return tags_res
+
+
+def load_tags(s):
+    session.add_all(build_tags(s))
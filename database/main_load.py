@@ -1,35 +1,169 @@
 import json
+import os
+import re
+import sys
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+
+from decouple import config
+from sqlalchemy import text
 
 import py.utils as u
 import database.db_load as d
+import database.migration as m
+from database.archive import Archive
+from database.bulk_load import BulkWriter
+from database.db_connect import Game, Card, game_tables
+from py.history_cache import HistoryCache
 from py.utils import logger
 
 
-def open_as_json(filename):
+# number of parsing processes, 0 parses in the calling process
+PARSE_WORKERS = config('PARSE_WORKERS', default=0, cast=int)
+# number of lines parsed by a process at once
+PARSE_BATCH_SIZE = config('PARSE_BATCH_SIZE', default=1000, cast=int)
+# malformed lines are appended there
+QUARANTINE_FILE = config(
+    'QUARANTINE_FILE',
+    default=os.path.join(os.path.dirname(__file__), '..', 'cache', 'quarantine.jsonl')
+)
+
+
+def read_lines(filename):
     with open(filename, 'r', encoding='utf-8') as file:
-        data = {}
-        for line in file.readlines():
-            try:
-                line_dict = json.loads(line.rstrip())
-                data[line_dict['id']] = line_dict
-            except json.decoder.JSONDecodeError:
-                print(line)
-                exit()
-        return data
-
-
-def load_games(path):
-    files = u.files_in_dir(path)
-    data = {}
-    for f in files:
-        print(f)
-        data = data | open_as_json(f'{path}{f}')
-    return data
-
-
-def load_from_files(all_games):
-    for g in all_games.values():
-        s = u.open_stats_by_game_id(g['players'][0], g['id'])
+        for line_no, line in enumerate(file, start=1):
+            if line.strip() != '':
+                yield filename, line_no, line.rstrip()
+
+
+def parse_batch(batch):
+    parsed = []
+    for filename, line_no, line in batch:
+        try:
+            parsed.append((json.loads(line), None))
+        except json.decoder.JSONDecodeError as e:
+            parsed.append((None, (filename, line_no, line, str(e))))
+    return parsed
+
+
+def parse(lines, pool=None, workers=PARSE_WORKERS):
+    batches = iter(lambda: list(islice(lines, PARSE_BATCH_SIZE)), [])
+    if pool is None:
+        for batch in batches:
+            yield from parse_batch(batch)
+        return
+    # a bounded number of batches in flight keeps the memory flat
+    in_flight = deque()
+    for batch in batches:
+        in_flight.append(pool.apply_async(parse_batch, (batch,)))
+        if len(in_flight) >= workers * 2:
+            yield from in_flight.popleft().get()
+    while len(in_flight) != 0:
+        yield from in_flight.popleft().get()
+
+
+def quarantine(filename, line_no, line, error, path=QUARANTINE_FILE):
+    logger.error(f'{filename}:{line_no}: {error}')
+    u.mkdir_p(os.path.dirname(path))
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(line + '\n')
+
+
+def open_as_json(filename, pool=None, workers=PARSE_WORKERS):
+    """Reads games from a file in json lines format one by one, malformed lines are quarantined.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the file
+    pool : Pool
+        Parsing processes, lines are parsed in the calling process by default
+    workers : int
+        Number of processes of the pool
+
+    Returns
+    -------
+    generator
+        Games
+    """
+    for g, bad_line in parse(read_lines(filename), pool, workers):
+        if bad_line is not None:
+            quarantine(*bad_line)
+            continue
+        yield g
+
+
+def name_order(filename):
+    """Sort key of file names which compares the numbers in them by value, so games_10 comes after games_9."""
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', filename)]
+
+
+def load_games(path, workers=PARSE_WORKERS):
+    """Reads games from all files in the directory, file by file in name order and line by line.
+    Only the first copy of a game is returned, the files may have games in any order.
+
+    Parameters
+    ----------
+    path : str
+        Path to the directory
+    workers : int
+        Number of parsing processes
+
+    Returns
+    -------
+    generator
+        Games
+    """
+    # one pool for all files, the processes are not started again for each of them
+    pool = Pool(workers) if workers != 0 else None
+    # a bit per game id, about 125 kB per million ids
+    seen = bytearray()
+    try:
+        for f in sorted(u.files_in_dir(path), key=name_order):
+            logger.info(f)
+            repeated = 0
+            for g in open_as_json(f'{path}{f}', pool, workers):
+                byte, bit = divmod(g['id'], 8)
+                if byte >= len(seen):
+                    seen.extend(bytes(max(byte + 1 - len(seen), len(seen))))
+                if seen[byte] >> bit & 1:
+                    repeated += 1
+                    continue
+                seen[byte] |= 1 << bit
+                yield g
+            if repeated != 0:
+                logger.info(f'{f}: {repeated} repeated games skipped')
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
+def load_from_files(all_games, bulk=False, first_id=None):
+    """Loads games with their rows from players' histories.
+
+    Parameters
+    ----------
+    all_games : iterable
+        Games
+    bulk : bool
+        A flag representing whether games are written in batches with the bulk writer
+    first_id : int
+        The smallest game id, history rows of older games are not indexed.
+        By default the smallest id loaded so far
+    """
+    histories = HistoryCache(min_game_id=first_id if first_id is not None else 0)
+    writer = BulkWriter() if bulk else None
+    for i, g in enumerate(all_games):
+        if first_id is None and (i == 0 or g['id'] < histories.min_game_id):
+            histories.min_game_id = g['id']
+        s = histories.get_game(g['id'], g['players'])
+        if s is None:
+            logger.error(f'not in history: {g["id"]}')
+            continue
+        if writer is not None:
+            writer.add(d.build_rows(g, s))
+            continue
         d.load_deck(g)
         d.load_game(g, s)
         # d.load_game_empty(g)
@@ -37,8 +171,11 @@ def load_from_files(all_games):
         d.load_notes(g)
         d.session.commit()
         logger.info(g['id'])
-        
-        
+    if writer is not None:
+        writer.flush()
+    histories.log_stats()
+
+
 def load_cards(all_games):
     for g in all_games:
         d.update_action_types(g)
@@ -54,4 +191,52 @@ def load_slots(all_games):
         logger.info(g.game_id)
 
 
-d.session.close()
+def load_from_archive(first_id=0, last_id=None, bulk=True, truncate=False):
+    """Rebuilds all tables from the archived payloads without requests to the site.
+    The game tables have to be empty, the archived games would collide with the stored ones otherwise.
+
+    Parameters
+    ----------
+    first_id : int
+        The first game id
+    last_id : int
+        The last game id, all archived games by default
+    bulk : bool
+        A flag representing whether games are written in batches with the bulk writer
+    truncate : bool
+        A flag representing whether the game tables are emptied first
+    """
+    tables = game_tables()
+    if truncate:
+        d.session.execute(text(f'truncate {", ".join(tables)}'))
+        d.session.commit()
+    elif d.session.query(Game.game_id).first() is not None or d.session.query(Card.seed).first() is not None:
+        logger.error(f'the game tables are not empty, run with --truncate to empty {", ".join(tables)}')
+        return
+    archive = Archive(read_only=True)
+    writer = BulkWriter() if bulk else None
+    loaded = 0
+    start_time = u.current_time()
+    for g, s in archive.games(first_id, last_id):
+        if writer is not None:
+            writer.add(d.build_rows(g, s))
+        else:
+            m.load(g, s)
+        loaded += 1
+    if writer is not None:
+        writer.flush()
+    archive.close()
+    seconds = u.time_spent(start_time).total_seconds()
+    logger.info(f'loaded {loaded} games from the archive in {round(seconds)}s ({u.p1(loaded, seconds)} games/sec)')
+
+
+if __name__ == "__main__":
+    # archive [first id] [last id] [--truncate]: rebuild tables from the archive
+    if len(sys.argv) > 1 and sys.argv[1] == 'archive':
+        args = [arg for arg in sys.argv[2:] if arg != '--truncate']
+        load_from_archive(
+            int(args[0]) if len(args) > 0 else 0,
+            int(args[1]) if len(args) > 1 else None,
+            truncate='--truncate' in sys.argv
+        )
+    d.session.close()
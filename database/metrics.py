@@ -0,0 +1,183 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from decouple import config
+
+from py.client import Histogram
+from py.utils import logger
+import py.utils as u
+
+
+# seconds between two summary lines and metrics file updates
+METRICS_INTERVAL = config('METRICS_INTERVAL', default=30, cast=float)
+# seconds of the rolling games/sec window
+METRICS_WINDOW = config('METRICS_WINDOW', default=60, cast=float)
+# metrics in the Prometheus text format: rewritten file and a local port, both off by default
+METRICS_FILE = config('METRICS_FILE', default='')
+METRICS_PORT = config('METRICS_PORT', default=0, cast=int)
+
+PREFIX = 'hanabi_ingest'
+# stages of a single game take milliseconds, http and commits take seconds
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 10, float('inf'))
+
+
+class Metrics:
+    """Timers of ingestion stages, rows written per table, loaded and skipped games
+    and the rolling games/sec. Safe to update from several threads."""
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.window = window
+        self.stages = {}
+        self.rows = {}
+        self.counters = {'loaded': 0, 'skipped': 0}
+        self.gauges = {}
+        self.loaded_at = deque()
+        self.client = None
+        self.start_time = time.monotonic()
+        self.last_report = self.start_time
+        self.lock = threading.Lock()
+
+    def stage(self, name):
+        with self.lock:
+            if name not in self.stages:
+                self.stages[name] = Histogram(STAGE_BUCKETS)
+            return self.stages[name]
+
+    @contextmanager
+    def time(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage(name).observe(time.perf_counter() - start)
+
+    def count_rows(self, table, n):
+        with self.lock:
+            self.rows[table] = self.rows.get(table, 0) + n
+
+    def loaded(self, n=1):
+        now = time.monotonic()
+        with self.lock:
+            self.counters['loaded'] += n
+            self.loaded_at.extend([now] * n)
+
+    def skipped(self, n=1):
+        with self.lock:
+            self.counters['skipped'] += n
+
+    def set(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def rate(self):
+        """Games per second over the last `window` seconds."""
+        now = time.monotonic()
+        with self.lock:
+            while len(self.loaded_at) != 0 and self.loaded_at[0] < now - self.window:
+                self.loaded_at.popleft()
+            count = len(self.loaded_at)
+        return u.p1(count, min(self.window, now - self.start_time))
+
+    def summary(self):
+        # share of the time spent in each stage, the slowest first
+        stages = sorted(self.stages.items(), key=lambda item: -item[1].sum)
+        timers = ', '.join(f'{name} {round(h.sum, 2)}s/{h.count} (p99<={h.quantile(0.99)}s)' for name, h in stages)
+        return (f'metrics: {self.counters["loaded"]} loaded, {self.counters["skipped"]} skipped, '
+                f'{self.rate()} games/sec | {timers} | rows: {self.rows}')
+
+    def prometheus(self):
+        """Renders the metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def histogram(name, label, histograms):
+            lines.append(f'# TYPE {PREFIX}_{name} histogram')
+            for key, h in histograms.items():
+                total = 0
+                for bound, count in zip(h.buckets, h.counts):
+                    total += count
+                    le = '+Inf' if bound == float('inf') else bound
+                    lines.append(f'{PREFIX}_{name}_bucket{{{label}="{key}",le="{le}"}} {total}')
+                lines.append(f'{PREFIX}_{name}_sum{{{label}="{key}"}} {h.sum}')
+                lines.append(f'{PREFIX}_{name}_count{{{label}="{key}"}} {h.count}')
+
+        histogram('stage_seconds', 'stage', self.stages)
+        lines.append(f'# TYPE {PREFIX}_rows_written_total counter')
+        lines += [f'{PREFIX}_rows_written_total{{table="{table}"}} {n}' for table, n in self.rows.items()]
+        for name, value in self.counters.items():
+            lines.append(f'# TYPE {PREFIX}_games_{name}_total counter')
+            lines.append(f'{PREFIX}_games_{name}_total {value}')
+        lines.append(f'# TYPE {PREFIX}_games_per_second gauge')
+        lines.append(f'{PREFIX}_games_per_second {self.rate()}')
+        for name, value in self.gauges.items():
+            if value is not None:
+                lines.append(f'# TYPE {PREFIX}_{name} gauge')
+                lines.append(f'{PREFIX}_{name} {value}')
+        if self.client is not None:
+            histogram('http_request_seconds', 'endpoint', self.client.latency)
+            for name, value in self.client.stats.items():
+                lines.append(f'# TYPE {PREFIX}_http_{name}_total counter')
+                lines.append(f'{PREFIX}_http_{name}_total {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write_file(self, path=METRICS_FILE):
+        # replaced at once, so a scraper never reads a half written file
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus())
+        os.replace(tmp_path, path)
+
+    def report(self, path=METRICS_FILE):
+        self.last_report = time.monotonic()
+        logger.info(self.summary())
+        if path:
+            self.write_file(path)
+
+    def maybe_report(self, interval=METRICS_INTERVAL):
+        """Logs the summary line and updates the metrics file once per interval."""
+        if time.monotonic() - self.last_report >= interval:
+            self.report()
+
+
+def serve(metrics, port=METRICS_PORT):
+    """Serves the metrics on http://localhost:<port>/metrics from a daemon thread.
+
+    Returns
+    -------
+    ThreadingHTTPServer
+        The server or None if the port is 0
+    """
+    if port == 0:
+        return None
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('localhost', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f'metrics: http://localhost:{port}/metrics')
+    return server
+
+
+shared = None
+
+
+def get_metrics():
+    """Gets the metrics shared by the whole process, serving them if METRICS_PORT is set."""
+    global shared
+    if shared is None:
+        shared = Metrics()
+        serve(shared)
+    return shared
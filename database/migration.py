@@ -1,55 +1,318 @@
+import sys
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from json.decoder import JSONDecodeError
 
-import requests
-from sqlalchemy import func
+from decouple import config
 
-from database.db_connect import Game, session
+from database.db_connect import session, GAME_MODELS
 from py.utils import logger
 import py.utils as u
+from py.client import Client
+from py.history_cache import HistoryCache
 import database.db_load as d
+import database.scanner as sc
+import database.metrics as me
+from database.archive import Archive, ARCHIVE_ENABLED
+from database.bulk_load import BulkWriter
 
 
-last_id = session.query(func.max(Game.game_id)).scalar()
-# last_id = 443662
-logger.info(datetime.now().strftime("%d.%m.%Y %H:%M:%S"))
-logger.info(f'last id: {last_id}')
-req_session = requests.Session()
-histories = {}
-while True:
-    g_id = last_id + 1
-    g = u.export_game(g_id, req_session)
-    if g != {}:
-        if len(g['players']) == 0:
-            logger.error(g_id)
-            last_id += 1
-            continue
-        player = g['players'][0]
-        if player in histories.keys():
-            s = u.open_stats_by_game_id(histories[player], g_id)
-        else:
-            try:
-                response = u.open_stats(player, req_session)
-            except JSONDecodeError:
-                logger.error(f'error: {g_id}')
-                last_id += 1
+# max number of export requests in flight
+WORKERS = config('MIGRATION_WORKERS', default=8, cast=int)
+# orm: game by game, bulk: batches written with COPY
+LOAD_METHOD = config('LOAD_METHOD', default='orm')
+# scan cursor of the incremental loader
+CURSOR = 'migration'
+# seconds between polls in watch mode
+WATCH_MIN_INTERVAL = config('WATCH_MIN_INTERVAL', default=5, cast=float)
+WATCH_MAX_INTERVAL = config('WATCH_MAX_INTERVAL', default=300, cast=float)
+# new games expected per poll
+WATCH_TARGET_GAMES = config('WATCH_TARGET_GAMES', default=20, cast=int)
+# weight of the last poll in the average arrival rate
+WATCH_SMOOTHING = config('WATCH_SMOOTHING', default=0.3, cast=float)
+# polls without new games in a row after which the ids past the head are scanned for games behind a gap
+WATCH_GAP_POLLS = config('WATCH_GAP_POLLS', default=10, cast=int)
+
+# state of the loader: newest id on the site, cursor, lag behind the head in games,
+# loaded games since start and the current poll interval in watch mode
+status = {'head_id': None, 'last_id': None, 'lag': None, 'loaded': 0, 'interval': None}
+
+
+def init_req_session(workers=WORKERS):
+    return Client(max_concurrency=workers)
+
+
+def fetch_games(first_id, req_session, workers=WORKERS, window=0, head_id=None):
+    """Yields (game id, exported game) in id order, keeping up to `workers` requests in flight.
+    Ids which could not be exported are yielded as {} once a later game is found.
+    Stops after more than `window` missing ids in a row beyond head_id."""
+    executor = ThreadPoolExecutor(max_workers=workers)
+    in_flight = deque()
+    next_id = first_id
+    misses = []
+    metrics = me.get_metrics()
+    try:
+        while True:
+            while len(in_flight) < workers:
+                in_flight.append((next_id, executor.submit(u.export_game, next_id, req_session)))
+                next_id += 1
+            g_id, future = in_flight.popleft()
+            # time the loader waits for http, the requests themselves are timed by the client
+            with metrics.time('fetch'):
+                g = future.result()
+            if g == {}:
+                misses.append(g_id)
+                if len(misses) > window and (head_id is None or g_id > head_id):
+                    logger.debug(f'end: {misses[0]}')
+                    return
                 continue
-            s = u.open_stats_by_game_id(response, g_id)
-            histories[player] = response
+            for miss in misses:
+                yield miss, {}
+            misses = []
+            yield g_id, g
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def get_stats(g, histories):
+    return histories.get_game(g['id'], g['players'])
+
+
+def count_rows(metrics, objects):
+    # skipped games and the scan cursor share the session with the games, they are not loaded rows
+    game_objects = (obj for obj in objects if isinstance(obj, tuple(GAME_MODELS)))
+    for table, n in Counter(obj.__tablename__ for obj in game_objects).items():
+        metrics.count_rows(table, n)
+
+
+def replay_and_commit(db_game, game_actions, deck, metrics):
+    """Writes the game added to the session together with its replayed card actions, clues and slots."""
+    # rows added with the game, an already stored deck is not among them
+    count_rows(metrics, d.session.new)
+    card_actions, clues = [], []
+    with metrics.time('card_actions'):
+        if not db_game.detrimental_characters:
+            card_actions, clues = d.load_card_actions_and_clues(db_game, game_actions, deck)
+    with metrics.time('slots'):
+        slots = d.load_slots(db_game, card_actions)
+    with metrics.time('commit'):
+        d.session.commit()
+    count_rows(metrics, card_actions + clues + slots)
+
+
+def load(g, s):
+    metrics = me.get_metrics()
+    with metrics.time('deck'):
         deck = d.load_deck(g)
+    # includes the variant lookup for the efficiency
+    with metrics.time('game'):
         db_game = d.load_game(g, s)
+    with metrics.time('actions'):
         game_actions = d.load_actions(g)
+    with metrics.time('notes_tags'):
         d.load_notes(g)
         d.load_tags(s)
-        if not db_game.detrimental_characters:
-            d.load_card_actions_and_clues(db_game, game_actions, deck)
-        last_id += 1
-        d.load_slots(db_game)
-        d.session.commit()
+    replay_and_commit(db_game, game_actions, deck, metrics)
+
+
+def load_one(g, histories, writer=None, archive=None):
+    """Loads an exported game.
+
+    Returns
+    -------
+    str
+        The reason why the game was skipped or None
+    """
+    if g == {}:
+        return 'missing'
+    if len(g['players']) == 0:
+        return 'no players'
+    metrics = me.get_metrics()
+    try:
+        with metrics.time('history'):
+            s = get_stats(g, histories)
+    except JSONDecodeError:
+        return 'history error'
+    if s is None:
+        return 'not in history'
+    if archive is not None:
+        with metrics.time('archive'):
+            archive.append(g, s)
+    if writer is None:
+        load(g, s)
     else:
-        d.session.close()
-        logger.info(datetime.now().strftime("%d.%m.%Y %H:%M:%S"))
-        logger.debug(f'end: {g_id}')
-        break
+        with metrics.time('build'):
+            rows = d.build_rows(g, s)
+        writer.add(rows)
+    return None
+
+
+def set_gauges(metrics):
+    for name in ['head_id', 'last_id', 'lag', 'interval']:
+        metrics.set(name, status[name])
+
+
+def scan(cursor, req_session, histories, archive=None, workers=WORKERS, method=LOAD_METHOD, window=sc.GAP_WINDOW,
+         scan_gaps=True):
+    """Loads games after the scan cursor. Missing games are recorded for a retry,
+    the scan ends after `window` missing ids in a row beyond the newest game on the site.
+    The cursor is saved with the loaded games, so the next run starts where this one ended.
+    Without `scan_gaps` nothing is fetched unless the head is past the cursor.
+
+    Returns
+    -------
+    int
+        Number of loaded games
+    """
+    metrics = me.get_metrics()
+    metrics.client = req_session
+    last_id = cursor.last_id
+    cursor.head_id = sc.find_head(last_id, req_session)
+    status['head_id'] = cursor.head_id
+    status['lag'] = cursor.head_id - last_id
+    set_gauges(metrics)
+    logger.info(f'last id: {last_id}, head: {cursor.head_id}, lag: {status["lag"]} games')
+    if not scan_gaps and cursor.head_id <= last_id:
+        status['last_id'] = last_id
+        session.commit()
+        return 0
+    histories.min_game_id = last_id + 1
+    writer = BulkWriter() if method == 'bulk' else None
+    loaded = skipped = 0
+    start_time = u.current_time()
+    for g_id, g in fetch_games(last_id + 1, req_session, workers, window, cursor.head_id):
+        sc.move_cursor(cursor, g_id)
+        reason = load_one(g, histories, writer, archive)
+        metrics.maybe_report()
+        if reason is not None:
+            logger.error(f'{reason}: {g_id}')
+            sc.skip(g_id, reason)
+            metrics.skipped()
+            skipped += 1
+            continue
+        metrics.loaded()
+        loaded += 1
+        logger.info(g_id)
+    if writer is not None:
+        writer.flush(commit=False)
+    session.commit()
+    status['last_id'] = cursor.last_id
+    status['lag'] = cursor.head_id - cursor.last_id
+    status['loaded'] += loaded
+    set_gauges(metrics)
+    seconds = u.time_spent(start_time).total_seconds()
+    logger.info(f'loaded {loaded} games, skipped {skipped} in {round(seconds)}s '
+                f'({u.p1(loaded, seconds)} games/sec, workers: {workers})')
+    return loaded
+
+
+def migrate(last_id=None, workers=WORKERS, method=LOAD_METHOD, window=sc.GAP_WINDOW):
+    req_session = init_req_session(workers)
+    cursor = sc.get_cursor(CURSOR)
+    if last_id is not None:
+        cursor.last_id = last_id
+    histories = HistoryCache(req_session)
+    archive = Archive() if ARCHIVE_ENABLED else None
+    loaded = scan(cursor, req_session, histories, archive, workers, method, window)
+    if archive is not None:
+        archive.close()
+    histories.log_stats()
+    req_session.log_stats()
+    me.get_metrics().report()
+    return loaded
+
 
-d.session.close()
+def next_interval(interval, rate):
+    """Calculates the seconds until the next poll: enough for WATCH_TARGET_GAMES new games
+    at the observed arrival rate, doubled while no games arrive.
+
+    Parameters
+    ----------
+    interval : float
+        The current interval
+    rate : float
+        Average number of new games per second
+
+    Returns
+    -------
+    float
+        The next interval
+    """
+    if rate == 0:
+        return min(interval * 2, WATCH_MAX_INTERVAL)
+    return min(max(WATCH_TARGET_GAMES / rate, WATCH_MIN_INTERVAL), WATCH_MAX_INTERVAL)
+
+
+def watch(workers=WORKERS, method=LOAD_METHOD, window=sc.GAP_WINDOW):
+    """Keeps polling for new games with one db connection, http session, history cache and archive."""
+    req_session = init_req_session(workers)
+    cursor = sc.get_cursor(CURSOR)
+    histories = HistoryCache(req_session)
+    archive = Archive() if ARCHIVE_ENABLED else None
+    interval = WATCH_MIN_INTERVAL
+    rate = None
+    last_poll = time.monotonic()
+    # an idle poll only probes the head, the gap window is scanned every WATCH_GAP_POLLS idle polls
+    idle_polls = 0
+    try:
+        while True:
+            scan_gaps = idle_polls % WATCH_GAP_POLLS == WATCH_GAP_POLLS - 1
+            loaded = scan(cursor, req_session, histories, archive, workers, method, window, scan_gaps)
+            idle_polls = 0 if loaded != 0 else idle_polls + 1
+            now = time.monotonic()
+            poll_rate = loaded / (now - last_poll)
+            last_poll = now
+            # smoothed, so a single busy poll does not swing the interval
+            rate = poll_rate if rate is None else WATCH_SMOOTHING * poll_rate + (1 - WATCH_SMOOTHING) * rate
+            interval = next_interval(interval, rate if loaded != 0 else 0)
+            status['interval'] = interval
+            set_gauges(me.get_metrics())
+            logger.info(f'watch: {status}, rate: {round(rate * 60, 1)} games/min, next poll in {round(interval)}s')
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        logger.info('watch: stopped')
+    finally:
+        session.rollback()
+        if archive is not None:
+            archive.close()
+        histories.log_stats()
+        req_session.log_stats()
+        me.get_metrics().report()
+
+
+def retry_skipped(workers=WORKERS, method=LOAD_METHOD):
+    """Tries to load the skipped games again."""
+    req_session = init_req_session(workers)
+    game_ids = sc.skipped_ids()
+    writer = BulkWriter() if method == 'bulk' else None
+    histories = HistoryCache(req_session, min_game_id=min(game_ids, default=0))
+    loaded = 0
+    for g_id in game_ids:
+        reason = load_one(u.export_game(g_id, req_session), histories, writer)
+        if reason is not None:
+            logger.error(f'{reason}: {g_id}')
+            sc.skip(g_id, reason)
+            continue
+        sc.unskip(g_id)
+        loaded += 1
+        logger.info(g_id)
+    if writer is not None:
+        writer.flush(commit=False)
+    session.commit()
+    logger.info(f'retried {len(game_ids)} skipped games, loaded {loaded}')
+    return loaded
+
+
+if __name__ == "__main__":
+    logger.info(datetime.now().strftime("%d.%m.%Y %H:%M:%S"))
+    # retry: load the skipped games again, watch: keep loading new games
+    if len(sys.argv) > 1 and sys.argv[1] == 'retry':
+        retry_skipped()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'watch':
+        watch()
+    else:
+        migrate()
+    logger.info(datetime.now().strftime("%d.%m.%Y %H:%M:%S"))
+    d.session.close()
@@ -0,0 +1,262 @@
+import queue
+import threading
+import time
+from datetime import datetime
+from json.decoder import JSONDecodeError
+
+from decouple import config
+
+from py.utils import logger
+import py.utils as u
+from py.history_cache import HistoryCache
+import database.db_load as d
+import database.migration as m
+import database.scanner as sc
+import database.metrics as me
+from database.archive import Archive, ARCHIVE_ENABLED
+
+
+# max number of items waiting between two stages
+QUEUE_SIZE = config('PIPELINE_QUEUE_SIZE', default=64, cast=int)
+# seconds between two stats lines
+REPORT_INTERVAL = config('PIPELINE_REPORT_INTERVAL', default=30, cast=int)
+# seconds a stage waits on a queue before checking whether the pipeline was stopped
+POLL_INTERVAL = 0.5
+
+# marks the end of the stream
+DONE = None
+
+
+class Stage:
+    """Throughput counters of a pipeline stage and depth of its input queue."""
+
+    def __init__(self, name, input_queue=None):
+        self.name = name
+        self.input_queue = input_queue
+        self.processed = 0
+        self.skipped = 0
+        self.busy = 0.0
+        self.max_depth = 0
+        self.start_time = time.monotonic()
+
+    def get(self, stop):
+        """Takes the next item, DONE once the input queue is empty and the pipeline was stopped."""
+        while True:
+            try:
+                item = self.input_queue.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if stop.is_set():
+                    return DONE
+                continue
+            self.max_depth = max(self.max_depth, self.input_queue.qsize() + 1)
+            return item
+
+    def done(self, busy_since):
+        self.processed += 1
+        self.busy += time.monotonic() - busy_since
+
+    def stats(self):
+        elapsed = time.monotonic() - self.start_time
+        return {
+            'processed': self.processed,
+            'skipped': self.skipped,
+            'per_sec': u.p1(self.processed, elapsed),
+            'busy': u.p(self.busy, elapsed),
+            'depth': self.input_queue.qsize() if self.input_queue is not None else 0,
+            'max_depth': self.max_depth
+        }
+
+
+def put(output_queue, item, stop):
+    """Puts the item unless the pipeline was stopped, so a stage never blocks on a queue nobody reads.
+
+    Returns
+    -------
+    bool
+        False if the pipeline was stopped
+    """
+    while not stop.is_set():
+        try:
+            output_queue.put(item, timeout=POLL_INTERVAL)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def guarded(target, stop, errors):
+    """Wraps a stage thread, its exception stops the pipeline and is re-raised by run_pipeline."""
+    def run(*args):
+        try:
+            target(*args)
+        except Exception as e:
+            logger.error(f'{target.__name__} failed: {e!r}')
+            errors.append(e)
+            stop.set()
+    return run
+
+
+def fetcher(stage, output_queue, first_id, req_session, workers, head_id, skipped, stop):
+    try:
+        for g_id, g in m.fetch_games(first_id, req_session, workers, sc.GAP_WINDOW, head_id):
+            busy_since = time.monotonic()
+            if g == {}:
+                skipped.append((g_id, 'missing'))
+                stage.skipped += 1
+                continue
+            if not put(output_queue, g, stop):
+                break
+            stage.done(busy_since)
+    finally:
+        put(output_queue, DONE, stop)
+
+
+def transform(g, histories, archive=None):
+    metrics = me.get_metrics()
+    with metrics.time('history'):
+        s = m.get_stats(g, histories)
+    if s is None:
+        return None
+    if archive is not None:
+        with metrics.time('archive'):
+            archive.append(g, s)
+    with metrics.time('build'):
+        return d.build_rows(g, s)
+
+
+def transformer(stage, output_queue, req_session, first_id, skipped, stop):
+    histories = HistoryCache(req_session, min_game_id=first_id)
+    archive = Archive() if ARCHIVE_ENABLED else None
+    try:
+        while (g := stage.get(stop)) is not DONE:
+            busy_since = time.monotonic()
+            if len(g['players']) == 0:
+                logger.error(g['id'])
+                skipped.append((g['id'], 'no players'))
+                stage.skipped += 1
+                continue
+            try:
+                rows = transform(g, histories, archive)
+            except JSONDecodeError:
+                logger.error(f'error: {g["id"]}')
+                skipped.append((g['id'], 'history error'))
+                stage.skipped += 1
+                continue
+            if rows is None:
+                logger.error(f'not in history: {g["id"]}')
+                skipped.append((g['id'], 'not in history'))
+                stage.skipped += 1
+                continue
+            if not put(output_queue, rows, stop):
+                break
+            stage.done(busy_since)
+    finally:
+        if archive is not None:
+            archive.close()
+        histories.log_stats()
+        put(output_queue, DONE, stop)
+
+
+def write(rows):
+    metrics = me.get_metrics()
+    with metrics.time('deck'):
+        deck = d.load_deck(rows['g'], rows['deck'])
+    db_game = rows['game']
+    d.session.add(db_game)
+    d.session.add_all(rows['actions'] + rows['notes'] + rows['tags'])
+    m.replay_and_commit(db_game, rows['actions'], deck, metrics)
+
+
+def log_stats(stages):
+    logger.info(' | '.join(
+        f'{stage.name}: {s["processed"]} ({s["per_sec"]}/s, busy {s["busy"]}%, '
+        f'queue {s["depth"]}/{s["max_depth"]})'
+        for stage, s in ((stage, stage.stats()) for stage in stages)
+    ))
+
+
+def record_skipped(skipped, cursor=None):
+    # games skipped by the other stages are saved before the cursor moves past them
+    while len(skipped) != 0:
+        game_id, reason = skipped.pop(0)
+        sc.skip(game_id, reason)
+        me.get_metrics().skipped()
+        # only once all stages have finished, a game before the skipped one may still be queued otherwise
+        if cursor is not None and game_id > cursor.last_id:
+            sc.move_cursor(cursor, game_id)
+
+
+def run_pipeline(last_id=None, workers=m.WORKERS, queue_size=QUEUE_SIZE):
+    """Loads new games with separate fetch, transform and write stages.
+
+    Stages are connected by bounded queues, so a slow stage blocks the one before it.
+    The writer runs in the calling thread and is the only user of the db session.
+    An exception in any stage stops the others and is re-raised once they have finished.
+    """
+    req_session = m.init_req_session(workers)
+    metrics = me.get_metrics()
+    metrics.client = req_session
+    cursor = sc.get_cursor(m.CURSOR)
+    if last_id is None:
+        last_id = cursor.last_id
+    cursor.head_id = sc.find_head(last_id, req_session)
+    metrics.set('head_id', cursor.head_id)
+    logger.info(f'last id: {last_id}, head: {cursor.head_id}')
+    skipped = []
+    stop = threading.Event()
+    errors = []
+    fetched, transformed = queue.Queue(queue_size), queue.Queue(queue_size)
+    stages = [Stage('fetch'), Stage('transform', fetched), Stage('write', transformed)]
+    fetch_stage, transform_stage, write_stage = stages
+    threads = [
+        threading.Thread(
+            target=guarded(fetcher, stop, errors),
+            args=(fetch_stage, fetched, last_id + 1, req_session, workers, cursor.head_id, skipped, stop),
+            daemon=True
+        ),
+        threading.Thread(
+            target=guarded(transformer, stop, errors),
+            args=(transform_stage, transformed, req_session, last_id + 1, skipped, stop),
+            daemon=True
+        )
+    ]
+    for t in threads:
+        t.start()
+
+    last_report = time.monotonic()
+    try:
+        while (rows := write_stage.get(stop)) is not DONE:
+            busy_since = time.monotonic()
+            record_skipped(skipped)
+            sc.move_cursor(cursor, rows['g']['id'])
+            write(rows)
+            write_stage.done(busy_since)
+            metrics.loaded()
+            metrics.set('last_id', cursor.last_id)
+            metrics.set('lag', cursor.head_id - cursor.last_id)
+            logger.info(rows['g']['id'])
+            if time.monotonic() - last_report >= REPORT_INTERVAL:
+                log_stats(stages)
+                metrics.report()
+                last_report = time.monotonic()
+    finally:
+        # the other stages have already finished unless the pipeline failed, then they stop at their next put
+        stop.set()
+        for t in threads:
+            t.join()
+    if len(errors) != 0:
+        d.session.rollback()
+        raise errors[0]
+    record_skipped(skipped, cursor)
+    d.session.commit()
+    log_stats(stages)
+    req_session.log_stats()
+    metrics.report()
+    return stages
+
+
+if __name__ == "__main__":
+    logger.info(datetime.now().strftime("%d.%m.%Y %H:%M:%S"))
+    run_pipeline()
+    logger.info(datetime.now().strftime("%d.%m.%Y %H:%M:%S"))
+    d.session.close()
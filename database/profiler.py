@@ -0,0 +1,198 @@
+import atexit
+import os
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+
+from decouple import config
+from sqlalchemy import event
+
+from database.metrics import STAGE_BUCKETS
+from py.client import Histogram
+from py.utils import logger
+import py.utils as u
+
+
+# count and time every statement executed by the engine
+SQL_PROFILE = config('SQL_PROFILE', default=False, cast=bool)
+# statements slower than that are explained with EXPLAIN ANALYZE
+SQL_SLOW_MS = config('SQL_SLOW_MS', default=500, cast=float)
+# a statement shape executed that many times in a run is reported as N+1
+SQL_N_PLUS_ONE = config('SQL_N_PLUS_ONE', default=1000, cast=int)
+SQL_PROFILE_DIR = config(
+    'SQL_PROFILE_DIR',
+    default=os.path.join(os.path.dirname(__file__), '..', 'cache', 'sql_profile')
+)
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+# analyze executes the statement again, so a cte writing rows is never explained
+WRITES = re.compile(r'\b(insert|update|delete|merge)\b', re.IGNORECASE)
+# the explain runs inside the transaction of the profiled code, a failure is rolled back to it
+SAVEPOINT = 'sql_profile_explain'
+# number of rows listed in each section of the report
+TOP = 20
+
+
+def shape(statement):
+    """Normalizes a statement, so the same query with other values or a longer IN list is counted once."""
+    statement = re.sub(r'\s+', ' ', statement).strip()
+    statement = re.sub(r"'(?:[^']|'')*'", '?', statement)
+    statement = re.sub(r'%\(\w+\)s|\b\d+\b', '?', statement)
+    return re.sub(r'\?(?:, \?)+', '?, ...', statement)
+
+
+def explainable(statement):
+    """Selects only, including the ones with a read-only with clause."""
+    head = statement.lstrip()[:6].lower()
+    return head == 'select' or (head.startswith('with') and WRITES.search(statement) is None)
+
+
+def call_site():
+    """The innermost frame of the repo code which executed the statement."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename.startswith(ROOT) and filename != os.path.abspath(__file__):
+            return f'{os.path.relpath(filename, ROOT)}:{frame.f_lineno} {frame.f_code.co_name}'
+        frame = frame.f_back
+    return 'unknown'
+
+
+class Profiler:
+    """Counts statements by shape and call site, records their latency distribution
+    and captures the plans of slow selects."""
+
+    def __init__(self, slow_ms=SQL_SLOW_MS, n_plus_one=SQL_N_PLUS_ONE):
+        self.slow_ms = slow_ms
+        self.n_plus_one = n_plus_one
+        # shape: {'latency': Histogram, 'sites': {call site: count}}
+        self.statements = {}
+        # shape: (milliseconds, statement, plan) of the slowest explained execution
+        self.plans = {}
+        self.start_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info['query_start'].pop()
+        key = shape(statement)
+        site = call_site()
+        with self.lock:
+            if key not in self.statements:
+                self.statements[key] = {'latency': Histogram(STAGE_BUCKETS), 'sites': {}}
+            stats = self.statements[key]
+            stats['sites'][site] = stats['sites'].get(site, 0) + 1
+        stats['latency'].observe(seconds)
+        if seconds * 1000 > self.slow_ms and not executemany:
+            self.explain(conn, key, statement, parameters, seconds * 1000)
+
+    def explain(self, conn, key, statement, parameters, ms):
+        if not explainable(statement):
+            return
+        if key in self.plans and self.plans[key][0] >= ms:
+            return
+        # a separate dbapi cursor is not seen by the engine events
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute(f'SAVEPOINT {SAVEPOINT}')
+        except Exception as e:
+            # outside of a transaction, there is nothing to protect but no savepoint either
+            cursor.close()
+            logger.debug(f'sql profile: not explained: {e}')
+            return
+        try:
+            cursor.execute(f'EXPLAIN ANALYZE {statement}', parameters)
+            plan = '\n'.join(str(row[0]) for row in cursor.fetchall())
+            cursor.execute(f'RELEASE SAVEPOINT {SAVEPOINT}')
+        except Exception as e:
+            # the failed explain aborted the transaction, the caller's next statement would fail otherwise
+            cursor.execute(f'ROLLBACK TO SAVEPOINT {SAVEPOINT}')
+            plan = f'not explained: {e}'
+        finally:
+            cursor.close()
+        with self.lock:
+            self.plans[key] = (round(ms, 1), statement, plan)
+
+    def attach(self, engine):
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def detach(self, engine):
+        event.remove(engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.remove(engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def suspects(self):
+        """Statement shapes repeated at least `n_plus_one` times, the most frequent first."""
+        return sorted(
+            ((key, s) for key, s in self.statements.items() if s['latency'].count >= self.n_plus_one),
+            key=lambda item: -item[1]['latency'].count
+        )
+
+    def report(self):
+        """Builds the text report: totals, the statements with the largest total time,
+        N+1 suspects with their call sites and the plans of slow statements."""
+        total = sum(s['latency'].count for s in self.statements.values())
+        total_time = sum(s['latency'].sum for s in self.statements.values())
+        elapsed = time.monotonic() - self.start_time
+        lines = [
+            f'{total} statements, {len(self.statements)} shapes, {round(total_time, 2)}s in the db '
+            f'of {round(elapsed, 2)}s ({u.p(total_time, elapsed)}%)',
+            '',
+            f'# top {TOP} by total time: total s, count, mean ms, p50, p99, shape'
+        ]
+        by_time = sorted(self.statements.items(), key=lambda item: -item[1]['latency'].sum)
+        for key, s in by_time[:TOP]:
+            h = s['latency']
+            lines.append(f'{round(h.sum, 3)}\t{h.count}\t{u.p1(h.sum * 1000, h.count)}\t'
+                         f'<={h.quantile(0.5)}s\t<={h.quantile(0.99)}s\t{key}')
+        lines += ['', f'# N+1 suspects: executed at least {self.n_plus_one} times']
+        for key, s in self.suspects():
+            lines.append(f'{s["latency"].count}\t{key}')
+            for site, count in sorted(s['sites'].items(), key=lambda item: -item[1])[:5]:
+                lines.append(f'\t{count}\t{site}')
+        lines += ['', f'# slower than {self.slow_ms} ms']
+        for ms, statement, plan in sorted(self.plans.values(), key=lambda p: -p[0])[:TOP]:
+            lines += [f'{ms} ms: {statement}', plan, '']
+        return '\n'.join(lines) + '\n'
+
+    def save(self, directory=SQL_PROFILE_DIR):
+        """Writes the report of the run into a new file.
+
+        Returns
+        -------
+        str
+            Path to the report
+        """
+        u.mkdir_p(directory)
+        script = os.path.splitext(os.path.basename(sys.argv[0]))[0] or 'python'
+        path = os.path.join(directory, f'{script}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.txt')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.report())
+        suspects = len(self.suspects())
+        logger.info(f'sql profile: {sum(s["latency"].count for s in self.statements.values())} statements, '
+                    f'{suspects} N+1 suspects, {len(self.plans)} slow, report: {path}')
+        return path
+
+
+profiler = None
+
+
+def enable(engine, enabled=SQL_PROFILE):
+    """Attaches the profiler to the engine if SQL_PROFILE is set, the report is saved on exit.
+
+    Returns
+    -------
+    Profiler
+        The profiler or None
+    """
+    global profiler
+    if not enabled or profiler is not None:
+        return profiler
+    profiler = Profiler()
+    profiler.attach(engine)
+    atexit.register(profiler.save)
+    return profiler
@@ -0,0 +1,141 @@
+import py.utils as u
+
+
+def init_piles(variant, suits):
+    if 'Up or Down' in variant:
+        piles = [[0, '']] * u.get_number_of_suits(variant)
+    else:
+        piles = [[0, 'up']] * u.get_number_of_suits(variant)
+        if 'Reversed' in variant:
+            piles[len(suits) - 1] = [6, 'down']
+    return piles
+
+
+def replay(deck, actions, players, starting_player, variant, suits, colors,
+           one_less_card=False, one_extra_card=False):
+    """Replays a game in one pass without touching the db.
+
+    Parameters
+    ----------
+    deck : list
+        Cards as (suit index, rank) ordered by card index
+    actions : list
+        Actions as (action type, target, value) ordered by turn
+    players : list
+        Players in seating order
+    starting_player : int
+        Index of the starting player
+    variant : str
+        Variant name
+    suits : list
+        Lowercased suit names of the variant
+    colors : list
+        Lowercased clue colors of the variant, color clues keep the color index if it is unknown
+    one_less_card : bool
+        A flag representing one less card option
+    one_extra_card : bool
+        A flag representing one extra card option
+
+    Returns
+    -------
+    card_actions : list
+        A card action per card index: [suit, rank, player, turn drawn, action type, turn of action]
+    clues : list
+        Clues as [turn clued, clue, clue type, clue giver, clue receiver]
+    piles : list
+        State of the piles at the end of the game
+    """
+    num_players = len(players)
+    players_mod = players[starting_player:] + players[:starting_player]
+    piles = init_piles(variant, suits)
+    # the first suit with the same name, like suits.index() does
+    suit_indices = [suits.index(s) for s in suits]
+
+    card_actions = [[suits[suit_index], rank, None, None, None, None] for suit_index, rank in deck]
+    current_card_ind = u.get_number_of_starting_cards(num_players, one_less_card, one_extra_card)
+    cards_per_hand = u.get_number_of_cards_in_hand(num_players, one_less_card, one_extra_card)
+    for i in range(min(current_card_ind, len(deck))):
+        card_actions[i][2] = players[i // cards_per_hand]
+        card_actions[i][3] = 0
+
+    clues = []
+    for turn, (action_type, target, value) in enumerate(actions):
+        if action_type == 4:
+            break
+        elif action_type in [2, 3]:
+            clues.append([
+                turn + 1,
+                colors[value] if action_type == 2 and value < len(colors) else value,
+                'color' if action_type == 2 else 'rank',
+                players_mod[turn % num_players],
+                players[target]
+            ])
+        elif action_type in [0, 1]:
+            card_action = card_actions[target]
+            if action_type == 0:
+                card_suit_ind = suit_indices[deck[target][0]]
+                card_rank = card_action[1]
+                if not u.is_played(piles, card_suit_ind, card_rank):
+                    card_action[4] = 'misplay'
+                else:
+                    card_action[4] = 'play'
+                    piles[card_suit_ind] = [card_rank, u.up_or_down_direction(piles, card_suit_ind, card_rank)]
+            else:
+                card_action[4] = 'discard'
+            card_action[5] = turn + 1
+            if current_card_ind == len(deck):
+                continue
+            next_card_action = card_actions[current_card_ind]
+            next_card_action[3] = turn + 1
+            next_card_action[2] = players_mod[turn % num_players]
+            current_card_ind += 1
+    return card_actions, clues, piles
+
+
+def track_slots(card_actions, cards_per_hand):
+    """Tracks the slot of each card in one pass, simulating players' hands.
+
+    Slot 1 is the newest card. When a card leaves a hand, the newer cards move one slot to the right,
+    at most as many as there were cards of the same player drawn since it and not yet gone.
+
+    Parameters
+    ----------
+    card_actions : list
+        Card actions as returned by replay()
+    cards_per_hand : int
+        Number of cards in each starting hand
+
+    Returns
+    -------
+    slots : list
+        Slot movements as [card index, turn, slot]
+    """
+    drawn = [(i, ca[2], ca[3], ca[5]) for i, ca in enumerate(card_actions) if ca[3] is not None]
+    slots = []
+    current_slot = {}
+    total_draws = {}
+    for card_index, player, turn_drawn, _ in drawn:
+        slot = cards_per_hand - card_index % cards_per_hand if turn_drawn == 0 else 1
+        slots.append([card_index, turn_drawn, slot])
+        current_slot[card_index] = slot
+        total_draws[player] = total_draws.get(player, 0) + 1
+
+    # newest card first
+    hands = {player: [] for player in total_draws}
+    past_draws = {player: 0 for player in total_draws}
+    draws = iter(sorted(drawn, key=lambda ca: ca[2]))
+    next_draw = next(draws, None)
+    for card_index, player, turn_drawn, turn_action in sorted(
+            (ca for ca in drawn if ca[3] is not None), key=lambda ca: ca[3]):
+        while next_draw is not None and next_draw[2] < turn_action:
+            hands[next_draw[1]].insert(0, next_draw)
+            past_draws[next_draw[1]] += 1
+            next_draw = next(draws, None)
+        hand = [ca for ca in hands[player] if ca[0] != card_index]
+        hands[player] = hand
+        # cards drawn at the same turn or later, including the ones still to be drawn
+        later_cards = len([ca for ca in hand if ca[2] >= turn_drawn]) + total_draws[player] - past_draws[player]
+        for ca in sorted(hand, key=lambda ca: -ca[0])[:min(later_cards, current_slot[card_index] - 1)]:
+            current_slot[ca[0]] += 1
+            slots.append([ca[0], turn_action, current_slot[ca[0]]])
+    return slots
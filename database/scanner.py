@@ -0,0 +1,107 @@
+from datetime import datetime
+
+from decouple import config
+from sqlalchemy import func
+
+from database.db_connect import session, Game, ScanCursor, SkippedGame
+import py.utils as u
+
+
+# number of missing ids in a row after the head which ends a scan
+GAP_WINDOW = config('SCAN_GAP_WINDOW', default=100, cast=int)
+# skipped games are not retried after that many attempts
+MAX_ATTEMPTS = config('SCAN_MAX_ATTEMPTS', default=5, cast=int)
+
+
+def exists(game_id, req_session=None):
+    return u.export_game(game_id, req_session) != {}
+
+
+def find_head(last_id, req_session=None):
+    """Finds the newest game id on the site: doubles the step after the last known id
+    until a game is missing, then bisects between the last found and the missing one.
+
+    Ids missing inside the range may hide newer games, the scan window covers that.
+
+    Parameters
+    ----------
+    last_id : int
+        An existing game id
+    req_session : session
+        Current session
+
+    Returns
+    -------
+    int
+        The newest found game id
+    """
+    step = 1
+    while exists(last_id + step, req_session):
+        last_id += step
+        step *= 2
+    low, high = last_id, last_id + step
+    while high - low > 1:
+        mid = (low + high) // 2
+        if exists(mid, req_session):
+            low = mid
+        else:
+            high = mid
+    return low
+
+
+def get_cursor(name):
+    """Gets the scan cursor, creating it from the newest stored game on the first run.
+
+    Parameters
+    ----------
+    name : str
+        Cursor name
+
+    Returns
+    -------
+    ScanCursor
+        The cursor attached to the session, it is saved with the next commit
+    """
+    cursor = session.get(ScanCursor, name)
+    if cursor is None:
+        last_id = session.query(func.max(Game.game_id)).scalar() or 0
+        cursor = ScanCursor(name, last_id, None, datetime.now())
+        session.add(cursor)
+    return cursor
+
+
+def move_cursor(cursor, game_id):
+    # ids come in increasing order, the expired cursor is not reloaded after each commit
+    cursor.last_id = game_id
+    cursor.date_time_updated = datetime.now()
+
+
+def skip(game_id, reason):
+    """Records the game for a later retry or counts one more attempt.
+
+    Parameters
+    ----------
+    game_id : int
+        Game id
+    reason : str
+        Why the game was not loaded
+    """
+    skipped = session.get(SkippedGame, game_id)
+    if skipped is None:
+        session.add(SkippedGame(game_id, reason, 1, datetime.now()))
+    else:
+        skipped.reason = reason
+        skipped.attempts += 1
+        skipped.date_time_updated = datetime.now()
+
+
+def unskip(game_id):
+    session.query(SkippedGame).filter(SkippedGame.game_id == game_id).delete(synchronize_session=False)
+
+
+def skipped_ids(max_attempts=MAX_ATTEMPTS):
+    skipped = session.query(SkippedGame.game_id) \
+        .filter(SkippedGame.attempts < max_attempts) \
+        .order_by(SkippedGame.game_id) \
+        .all()
+    return [s[0] for s in skipped]
@@ -19,6 +19,8 @@ ALTER TABLE games ADD COLUMN date_time_started timestamp;
 ALTER TABLE games ADD COLUMN date_time_finished timestamp;
 ALTER TABLE games ADD COLUMN num_games_on_this_seed integer;
 ALTER TABLE games ADD COLUMN tags varchar;
+-- score equals the max score of the variant, filled by: python -m database.backfill is_win --restart
+ALTER TABLE games ADD COLUMN is_win boolean;
 
 ALTER TABLE games ADD CONSTRAINT games_variant_id_fkey FOREIGN KEY (variant_id) REFERENCES variants (variant_id);
 
@@ -52,6 +54,29 @@ create table players_list(
     player varchar(255) primary key
 );
 
+create table backfill_chunks(
+    job varchar,
+    chunk_start int,
+    chunk_end int,
+    games int,
+    date_time_finished timestamp,
+    primary key (job, chunk_start)
+);
+
+create table scan_cursors(
+    name varchar primary key,
+    last_id int,
+    head_id int,
+    date_time_updated timestamp
+);
+
+create table skipped_games(
+    game_id int primary key,
+    reason varchar,
+    attempts int,
+    date_time_updated timestamp
+);
+
 create table bugged_games(
     game_id int primary key
 );
@@ -0,0 +1,225 @@
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from decouple import config
+from requests.adapters import HTTPAdapter
+
+from py.utils import logger
+
+
+HANABI_URL = config('HANABI_URL', default='https://hanab.live')
+# seconds to wait for a connection and for a response
+HTTP_TIMEOUT = config('HTTP_TIMEOUT', default=30, cast=float)
+# retries after 429, 5xx, timeouts and connection errors
+HTTP_RETRIES = config('HTTP_RETRIES', default=5, cast=int)
+# seconds before the first retry, doubled for every next one
+HTTP_BACKOFF = config('HTTP_BACKOFF', default=0.5, cast=float)
+# requests per second and burst size for each host
+HTTP_RATE = config('HTTP_RATE', default=20, cast=float)
+HTTP_BURST = config('HTTP_BURST', default=20, cast=int)
+# bounds of the number of requests in flight for each host
+HTTP_MIN_CONCURRENCY = config('HTTP_MIN_CONCURRENCY', default=1, cast=int)
+HTTP_MAX_CONCURRENCY = config('HTTP_MAX_CONCURRENCY', default=16, cast=int)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average and up to `capacity` at once."""
+
+    def __init__(self, rate=HTTP_RATE, capacity=HTTP_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # the token is taken in advance, so waiting requests are served in order
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ConcurrencyLimit:
+    """Limits the number of requests in flight, the limit grows by one per window of successful
+    requests and is halved when the server is overloaded (additive increase, multiplicative decrease)."""
+
+    def __init__(self, minimum=HTTP_MIN_CONCURRENCY, maximum=HTTP_MAX_CONCURRENCY):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, overloaded):
+        with self.condition:
+            self.in_flight -= 1
+            if overloaded:
+                self.limit = max(self.minimum, self.limit / 2)
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+class Histogram:
+    """Counts observed values by upper bounds of buckets."""
+
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float('inf'))
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket containing the quantile."""
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if count != 0 and total >= rank:
+                return bound
+        return None
+
+
+class Client:
+    """HTTP client shared by everything fetching from the site: one pooled session,
+    a token bucket and a concurrency limit for each host, timeouts and jittered exponential retries.
+    Latency of every request is recorded by endpoint.
+    """
+
+    def __init__(self, base_url=HANABI_URL, max_concurrency=HTTP_MAX_CONCURRENCY, rate=HTTP_RATE, burst=HTTP_BURST,
+                 timeout=HTTP_TIMEOUT, retries=HTTP_RETRIES, backoff=HTTP_BACKOFF):
+        self.base_url = base_url.rstrip('/')
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.burst = burst
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.hosts = {}
+        self.latency = {}
+        self.stats = {'requests': 0, 'retries': 0, 'errors': 0}
+        self.lock = threading.Lock()
+
+    def url(self, path):
+        return path if '://' in path else f'{self.base_url}/{path.lstrip("/")}'
+
+    def host(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = (TokenBucket(self.rate, self.burst), ConcurrencyLimit(maximum=self.max_concurrency))
+            return self.hosts[host]
+
+    def histogram(self, url):
+        # the first path segments without names and ids: export, api/v1/history-full, missing-scores
+        endpoint = '/'.join(s for s in urlsplit(url).path.split('/')[1:-1]) or urlsplit(url).path
+        with self.lock:
+            if endpoint not in self.latency:
+                self.latency[endpoint] = Histogram()
+            return self.latency[endpoint]
+
+    def delay(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after is not None and retry_after.isdigit():
+            return int(retry_after)
+        return self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+
+    def get(self, path):
+        """Gets the url or the path relative to the base url. Overload responses and network errors
+        are retried, other responses are returned as they are.
+
+        Parameters
+        ----------
+        path : str
+            URL or path
+
+        Returns
+        -------
+        Response
+            The response, the last one if all retries were overloaded
+        """
+        url = self.url(path)
+        bucket, limit = self.host(url)
+        histogram = self.histogram(url)
+        for attempt in range(self.retries + 1):
+            bucket.acquire()
+            limit.acquire()
+            start = time.monotonic()
+            response, error = None, None
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            finally:
+                overloaded = response is None or response.status_code in RETRY_STATUSES
+                limit.release(overloaded)
+            histogram.observe(time.monotonic() - start)
+            with self.lock:
+                self.stats['requests'] += 1
+            if not overloaded:
+                return response
+            if attempt == self.retries:
+                break
+            with self.lock:
+                self.stats['retries'] += 1
+            logger.debug(f'retry {attempt + 1}: {url} ({error or response.status_code})')
+            time.sleep(self.delay(attempt, response))
+        with self.lock:
+            self.stats['errors'] += 1
+        if response is None:
+            raise error
+        return response
+
+    def get_json(self, path):
+        return self.get(path).json()
+
+    def log_stats(self):
+        limits = {host: round(limit.limit, 1) for host, (_, limit) in self.hosts.items()}
+        latency = {
+            endpoint: f'n={h.count}, p50<={h.quantile(0.5)}s, p99<={h.quantile(0.99)}s'
+            for endpoint, h in self.latency.items()
+        }
+        logger.info(f'http: {self.stats}, concurrency: {limits}, latency: {latency}')
+
+
+shared = None
+
+
+def get_client():
+    """Gets the client shared by the whole process."""
+    global shared
+    if shared is None:
+        shared = Client()
+    return shared
@@ -2,7 +2,9 @@ import csv
 from sqlalchemy import false
 
 import py.utils as u
-from database.db_connect import session, Game, Player
+from py.report_engine import Accumulator
+import py.report_engine as engine
+from database.db_connect import session, Game
 
 
 def sort_terminated(condition_count_dict):
@@ -95,12 +97,18 @@ def count_conditions(username):
     return condition_count_dict
 
 
-if __name__ == "__main__":
-    users = session.query(Player.player).all()
-    users_conditions = {}
+class EndConditions(Accumulator):
+    """Number of games for each end condition, as count_conditions for all players at once."""
+
+    def new(self):
+        return {**{i: 0 for i in range(11)}, 'total': 0}
 
-    for user in users:
-        user = user[0]
-        users_conditions[user] = count_conditions(user)
+    def add(self, player, g):
+        condition_count_dict = self.get(player)
+        condition_count_dict[g.end_condition] += 1
+        condition_count_dict['total'] += 1
 
+
+if __name__ == "__main__":
+    users_conditions = engine.run([EndConditions()])[0]
     save(sort_terminated(users_conditions))
@@ -1,11 +1,19 @@
 import csv
 from sqlalchemy import false
 
-from database.db_connect import session, Game, Player
+from py.report_engine import Accumulator
+import py.report_engine as engine
+from database.db_connect import session, Game
 
 
-def save_all():
-    """Saves all suits with number of games for each player."""
+def save_all(players_suits):
+    """Saves all suits with number of games for each player.
+
+    Parameters
+    ----------
+    players_suits : dict
+        Suits with number of games grouped by player
+    """
     with open('../output/variants/favourite_suits.tsv', 'w', encoding='utf-8', newline='') as file:
         w = csv.writer(file, delimiter='\t', quotechar='"', quoting=csv.QUOTE_NONE, escapechar='\\')
         w.writerow(['Player',
@@ -53,8 +61,14 @@ def save_all():
             ])
 
 
-def save_top():
-    """Saves top 5 suits with number of games for each player."""
+def save_top(players_suits):
+    """Saves top 5 suits with number of games for each player.
+
+    Parameters
+    ----------
+    players_suits : dict
+        Suits with number of games grouped by player
+    """
     with open('../output/variants/favourite_suits_top_r.tsv', 'w', encoding='utf-8', newline='') as file:
         w = csv.writer(file, delimiter='\t', quotechar='"', quoting=csv.QUOTE_NONE, escapechar='\\')
         w.writerow(['Player',
@@ -163,23 +177,51 @@ def get_suits(username):
         Suits with calculated number of games
     """
     suits = init_suits()
-    variants = get_variants(username)
+    player_variants = get_variants(username)
 
-    for var in variants:
-        variant = var[0].split('&')
-        variant = [clean_variant(v) for v in variant]
-        for suit in variant:
+    for var in player_variants:
+        for suit in get_variant_suits(var[0]):
             if suit in suits:
                 suits[suit] += 1
     return suits
 
 
+def get_variant_suits(variant):
+    """Gets cleaned suit names of the variant as in get_suits, parsed from its name.
+
+    Parameters
+    ----------
+    variant : str
+        Variant name
+
+    Returns
+    -------
+    list
+        Suits of the variant
+    """
+    return [clean_variant(v) for v in variant.split('&')]
+
+
+class FavSuits(Accumulator):
+    """Number of games containing a special suit, as get_suits for all players at once."""
+
+    def __init__(self):
+        super().__init__()
+        # special suits of each variant, counted for every player of its games
+        self.variant_suits = {}
+
+    def new(self):
+        return init_suits()
+
+    def add(self, player, g):
+        if g.variant not in self.variant_suits:
+            self.variant_suits[g.variant] = [s for s in get_variant_suits(g.variant) if s in init_suits()]
+        suits = self.get(player)
+        for suit in self.variant_suits[g.variant]:
+            suits[suit] += 1
+
+
 if __name__ == "__main__":
-    users = session.query(Player.player).all()
-    players_suits = {}
-    for user in users:
-        user = user[0]
-        players_suits[user] = get_suits(user)
-
-    save_all()
-    save_top()
+    players_suits = engine.run([FavSuits()])[0]
+    save_all(players_suits)
+    save_top(players_suits)
@@ -0,0 +1,262 @@
+import json
+import os
+import sys
+
+import numpy as np
+from decouple import config
+
+import py.utils as u
+import py.variants as variants
+from py.utils import logger
+
+
+GAME_STORE_DIR = config(
+    'GAME_STORE_DIR',
+    default=os.path.join(os.path.dirname(__file__), '..', 'cache', 'game_store')
+)
+# number of games fetched from the server-side cursor at once
+GAME_STORE_BATCH_SIZE = config('GAME_STORE_BATCH_SIZE', default=10000, cast=int)
+
+# column: dtype, unknown values are stored as -1 or the epoch
+COLUMNS = {
+    'game_id': np.int64,
+    'variant_id': np.int32,
+    'num_players': np.int8,
+    'starting_player': np.int8,
+    'score': np.int16,
+    'max_score': np.int16,
+    'end_condition': np.int8,
+    'date_time_started': 'datetime64[s]',
+    'date_time_finished': 'datetime64[s]'
+}
+FLAGS = [
+    'timed',
+    'speedrun',
+    'card_cycle',
+    'deck_plays',
+    'empty_clues',
+    'one_extra_card',
+    'one_less_card',
+    'all_or_nothing',
+    'detrimental_characters'
+]
+# the stored win flag or, if it is not set, score compared with the max score
+WIN = 'win'
+# arrays of the player index: player ids of each game and row offsets of each player (CSR)
+INDEX = ['team_offsets', 'team', 'player_offsets', 'player_games']
+
+
+class GameStore:
+    """Snapshot of the games table in NumPy columns, one row per game in id order.
+
+    Players are interned to ids. `team[team_offsets[i]:team_offsets[i + 1]]` are the players of row i
+    and `player_games[player_offsets[p]:player_offsets[p + 1]]` are the rows of player p in increasing order,
+    so the games of a player or a team are array slices and their wins are a sum over the `win` mask.
+    """
+
+    def __init__(self, arrays, players):
+        self.arrays = arrays
+        self.players = players
+        self.player_ids = {player: i for i, player in enumerate(players)}
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['arrays'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __len__(self):
+        return len(self.arrays['game_id'])
+
+    def team_games(self):
+        """Mask of 3+ players games without speedruns."""
+        return (self.num_players != 2) & ~self.speedrun
+
+    def team_of(self, row):
+        return [self.players[p] for p in self.team[self.team_offsets[row]:self.team_offsets[row + 1]]]
+
+    def games_of(self, player):
+        """Rows of the player's games, empty for an unknown player."""
+        p = self.player_ids.get(player)
+        if p is None:
+            return np.empty(0, dtype=np.int64)
+        return self.player_games[self.player_offsets[p]:self.player_offsets[p + 1]]
+
+    def games_of_team(self, players):
+        """Rows of the games where all the players played together."""
+        rows = self.games_of(players[0])
+        for player in players[1:]:
+            rows = np.intersect1d(rows, self.games_of(player), assume_unique=True)
+        return rows
+
+    def wins(self, rows, mask=None):
+        """Number of won games among the rows, optionally only those selected by the mask."""
+        won = self.win[rows]
+        if mask is not None:
+            won &= mask[rows]
+        return int(won.sum())
+
+    def losses(self, rows, mask=None):
+        lost = ~self.win[rows]
+        if mask is not None:
+            lost &= mask[rows]
+        return int(lost.sum())
+
+    def save(self, directory=GAME_STORE_DIR):
+        """Saves every array to a .npy file and the player names to players.json."""
+        u.mkdir_p(directory)
+        for name, array in self.arrays.items():
+            np.save(os.path.join(directory, f'{name}.npy'), array)
+        with open(os.path.join(directory, 'players.json'), 'w', encoding='utf-8') as f:
+            f.write(json.dumps(self.players))
+        logger.info(f'game store: {len(self)} games, {len(self.players)} players saved to {directory}')
+
+    @classmethod
+    def load(cls, directory=GAME_STORE_DIR, mmap=True):
+        """Loads a saved snapshot, memory-mapping the arrays by default,
+        so only the pages of the used columns are read."""
+        mmap_mode = 'r' if mmap else None
+        arrays = {
+            name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode)
+            for name in list(COLUMNS) + FLAGS + [WIN] + INDEX
+        }
+        with open(os.path.join(directory, 'players.json'), 'r', encoding='utf-8') as f:
+            players = json.loads(f.read())
+        return cls(arrays, players)
+
+
+def build_index(team_offsets, team, players_count):
+    """Builds the player -> rows index from the players of each row.
+
+    Parameters
+    ----------
+    team_offsets : ndarray
+        Start of the players of each row in `team` and the total length
+    team : ndarray
+        Player ids of all rows
+    players_count : int
+        Number of players
+
+    Returns
+    -------
+    tuple
+        Row offsets of each player and the rows of all players
+    """
+    rows = np.repeat(np.arange(len(team_offsets) - 1, dtype=np.int64), np.diff(team_offsets))
+    # stable, so the rows of each player stay in increasing order
+    player_games = rows[np.argsort(team, kind='stable')]
+    player_offsets = np.zeros(players_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(team, minlength=players_count), out=player_offsets[1:])
+    return player_offsets, player_games
+
+
+def from_rows(rows):
+    """Builds a store from game rows with the attributes named in COLUMNS and FLAGS, `is_win` and `players`.
+
+    Parameters
+    ----------
+    rows : iterable
+        Games in id order
+
+    Returns
+    -------
+    GameStore
+        The store
+    """
+    values = {name: [] for name in list(COLUMNS) + FLAGS + [WIN]}
+    players, player_ids = [], {}
+    team_offsets, team = [0], []
+    epoch = np.datetime64(0, 's')
+    for row in rows:
+        for name in COLUMNS:
+            if name == 'max_score':
+                # the perfect score, not the best score achieved with the number of players
+                value = variants.get_max_score(row.variant_id)
+            else:
+                value = getattr(row, name)
+            if value is None:
+                value = epoch if name.startswith('date_time') else -1
+            values[name].append(value)
+        for name in FLAGS:
+            values[name].append(bool(getattr(row, name)))
+        is_win = row.is_win
+        values[WIN].append(is_win if is_win is not None else bool(variants.is_win(row.score, row.variant_id)))
+        for player in row.players:
+            if player not in player_ids:
+                player_ids[player] = len(players)
+                players.append(player)
+            team.append(player_ids[player])
+        team_offsets.append(len(team))
+    arrays = {name: np.array(values[name], dtype=dtype) for name, dtype in COLUMNS.items()}
+    arrays.update({name: np.array(values[name], dtype=bool) for name in FLAGS + [WIN]})
+    arrays['team_offsets'] = np.array(team_offsets, dtype=np.int64)
+    arrays['team'] = np.array(team, dtype=np.int32)
+    arrays['player_offsets'], arrays['player_games'] = build_index(
+        arrays['team_offsets'], arrays['team'], len(players)
+    )
+    return GameStore(arrays, players)
+
+
+def build(batch_size=GAME_STORE_BATCH_SIZE):
+    """Snapshots the games table into a store."""
+    from database.db_connect import session, Game
+
+    columns = [getattr(Game, name) for name in list(COLUMNS) + FLAGS + ['is_win', 'players'] if name != 'max_score']
+    query = session.query(*columns).order_by(Game.game_id).yield_per(batch_size)
+    store = from_rows(query)
+    logger.info(f'game store: {len(store)} games, {len(store.players)} players')
+    return store
+
+
+def table_fingerprint():
+    """Number of games, the newest game id and the number of won games of the games table.
+    A gap filled in the middle of the table or recomputed win flags change it too."""
+    from sqlalchemy import func
+    from database.db_connect import session, Game
+
+    row = session.query(func.count(), func.max(Game.game_id), func.count().filter(Game.is_win)).one()
+    return list(row)
+
+
+def saved_fingerprint(directory=GAME_STORE_DIR):
+    path = os.path.join(directory, 'fingerprint.json')
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.loads(f.read())
+
+
+def get_store(directory=GAME_STORE_DIR, rebuild=False):
+    """Loads the saved snapshot or builds and saves a new one.
+    A snapshot taken when the games table had another fingerprint is stale and rebuilt.
+
+    Parameters
+    ----------
+    directory : str
+        Snapshot directory
+    rebuild : bool
+        Ignore the saved snapshot
+
+    Returns
+    -------
+    GameStore
+        The store
+    """
+    # taken before the build, so games written meanwhile make the next load rebuild
+    fingerprint = table_fingerprint()
+    if not rebuild and os.path.isfile(os.path.join(directory, 'players.json')):
+        snapshot_fingerprint = saved_fingerprint(directory)
+        if snapshot_fingerprint == fingerprint:
+            return GameStore.load(directory)
+        logger.info(f'game store: snapshot of {snapshot_fingerprint} (games, newest id, wins), '
+                    f'games table {fingerprint}, rebuilding')
+    store = build()
+    store.save(directory)
+    with open(os.path.join(directory, 'fingerprint.json'), 'w', encoding='utf-8') as f:
+        f.write(json.dumps(fingerprint))
+    return store
+
+
+if __name__ == "__main__":
+    # [directory]: snapshot the games table
+    get_store(sys.argv[1] if len(sys.argv) > 1 else GAME_STORE_DIR, rebuild=True)
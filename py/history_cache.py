@@ -0,0 +1,225 @@
+import atexit
+import gzip
+import json
+import os
+from collections import OrderedDict
+from urllib.parse import quote
+
+from decouple import config
+
+import py.utils as u
+from py.utils import logger
+
+
+HISTORY_CACHE_DIR = config(
+    'HISTORY_CACHE_DIR',
+    default=os.path.join(os.path.dirname(__file__), '..', 'cache', 'histories')
+)
+# memory budget in history rows, a parsed row takes about 1.5 KB
+HISTORY_CACHE_ROWS = config('HISTORY_CACHE_ROWS', default=200000, cast=int)
+# number of written histories after which the index of newest game ids is saved
+HISTORY_INDEX_FLUSH = config('HISTORY_INDEX_FLUSH', default=100, cast=int)
+
+
+class HistoryCache:
+    """Players' histories kept in memory up to a budget, least recently used evicted first,
+    and stored on disk as gzipped json, one file per player.
+
+    The newest game id of every history is remembered in index.json, saved every HISTORY_INDEX_FLUSH
+    written histories and on exit. When a newer game is requested,
+    only the games after it are fetched and merged into the stored history.
+
+    Rows of the histories in memory starting from min_game_id are merged into one index by game id,
+    so a game which came with a teammate's history is found without another download.
+    The rows of an evicted history leave the index unless another history in memory has the game.
+    """
+
+    def __init__(self, req_session=None, directory=HISTORY_CACHE_DIR, memory_budget=HISTORY_CACHE_ROWS,
+                 min_game_id=0, index_flush=HISTORY_INDEX_FLUSH):
+        self.req_session = req_session
+        self.directory = directory
+        self.memory_budget = memory_budget
+        self.min_game_id = min_game_id
+        self.index_flush = index_flush
+        self.memory = OrderedDict()
+        self.size = 0
+        self.games = {}
+        # number of histories in memory with the indexed game
+        self.refs = {}
+        self.stats = {
+            'memory_hits': 0, 'disk_hits': 0, 'downloads': 0, 'stale': 0, 'synced_rows': 0, 'evictions': 0,
+            'index_hits': 0, 'index_misses': 0, 'downloads_saved': 0
+        }
+        u.mkdir_p(directory)
+        self.index_path = os.path.join(directory, 'index.json')
+        if os.path.isfile(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self.newest = json.loads(f.read())
+        else:
+            self.newest = {}
+        # histories written since the index was saved
+        self.unsaved = 0
+        atexit.register(self.flush)
+
+    def path(self, player):
+        return os.path.join(self.directory, f'{quote(player, safe="")}.json.gz')
+
+    def index(self, history):
+        for row in history:
+            if row['id'] >= self.min_game_id:
+                self.games[row['id']] = row
+                self.refs[row['id']] = self.refs.get(row['id'], 0) + 1
+
+    def unindex(self, history):
+        for row in history:
+            if row['id'] not in self.refs:
+                continue
+            self.refs[row['id']] -= 1
+            if self.refs[row['id']] == 0:
+                del self.refs[row['id']]
+                self.games.pop(row['id'], None)
+
+    def remember(self, player, history):
+        # the new history is indexed first, so the games it shares with the replaced one stay
+        self.index(history)
+        if player in self.memory:
+            old_history = self.memory.pop(player)
+            self.size -= len(old_history)
+            self.unindex(old_history)
+        self.memory[player] = history
+        self.size += len(history)
+        while self.size > self.memory_budget and len(self.memory) > 1:
+            _, evicted = self.memory.popitem(last=False)
+            self.size -= len(evicted)
+            self.unindex(evicted)
+            self.stats['evictions'] += 1
+
+    def read(self, player):
+        with gzip.open(self.path(player), 'rt', encoding='utf-8') as f:
+            return json.loads(f.read())
+
+    def write(self, player, history):
+        tmp_path = self.path(player) + '.tmp'
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            f.write(json.dumps(history))
+        os.replace(tmp_path, self.path(player))
+        self.newest[player] = max((row['id'] for row in history), default=0)
+        self.unsaved += 1
+        if self.unsaved >= self.index_flush:
+            self.flush()
+
+    def flush(self):
+        """Saves the index of newest game ids if histories were written since the last save.
+        A history missing from a lost index is downloaded again, a lagging one is synced from an older id."""
+        if self.unsaved == 0:
+            return
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(self.newest))
+        os.replace(tmp_path, self.index_path)
+        self.unsaved = 0
+
+    def download(self, player):
+        history = u.open_stats(player, self.req_session)
+        self.stats['downloads'] += 1
+        self.write(player, history)
+        self.remember(player, history)
+        return history
+
+    def sync(self, player):
+        history = self.memory[player] if player in self.memory else self.read(player)
+        new_rows = u.open_new_stats(player, self.newest[player], self.req_session)
+        self.stats['synced_rows'] += len(new_rows)
+        if len(new_rows) == 0:
+            self.remember(player, history)
+            return history
+        new_ids = {row['id'] for row in new_rows}
+        history = sorted(new_rows + [row for row in history if row['id'] not in new_ids], key=lambda row: -row['id'])
+        self.write(player, history)
+        self.remember(player, history)
+        return history
+
+    def refresh(self, player):
+        """Gets player's history with all the games played so far.
+
+        Parameters
+        ----------
+        player : str
+            Player name
+
+        Returns
+        -------
+        list
+            History in json format
+        """
+        if player not in self.newest or not os.path.isfile(self.path(player)):
+            return self.download(player)
+        return self.sync(player)
+
+    def is_stale(self, player, game_id):
+        return game_id is not None and game_id > self.newest.get(player, 0)
+
+    def get(self, player, game_id=None):
+        """Gets player's history, downloading it if it is unknown or older than the game.
+
+        Parameters
+        ----------
+        player : str
+            Player name
+        game_id : int
+            Game id which has to be in the history
+
+        Returns
+        -------
+        list
+            History in json format
+        """
+        if player not in self.newest or not os.path.isfile(self.path(player)):
+            return self.download(player)
+        if self.is_stale(player, game_id):
+            self.stats['stale'] += 1
+            return self.sync(player)
+        if player in self.memory:
+            self.memory.move_to_end(player)
+            self.stats['memory_hits'] += 1
+            return self.memory[player]
+        history = self.read(player)
+        self.stats['disk_hits'] += 1
+        self.remember(player, history)
+        return history
+
+    def get_game(self, game_id, players):
+        """Gets the game from the index or from players' histories, downloading at most
+        the first player's history. The game is removed from the index.
+
+        Parameters
+        ----------
+        game_id : int
+            Game id
+        players : list
+            Players of the game
+
+        Returns
+        -------
+        dict
+            The game from the history or None
+        """
+        if game_id in self.games:
+            self.stats['index_hits'] += 1
+            if self.is_stale(players[0], game_id):
+                self.stats['downloads_saved'] += 1
+            return self.games.pop(game_id)
+        self.stats['index_misses'] += 1
+        for player in players:
+            if not self.is_stale(player, game_id) and os.path.isfile(self.path(player)):
+                self.get(player, game_id)
+                if game_id in self.games:
+                    return self.games.pop(game_id)
+        self.get(players[0], game_id)
+        return self.games.pop(game_id, None)
+
+    def log_stats(self):
+        lookups = self.stats['index_hits'] + self.stats['index_misses']
+        logger.info(f'history cache: {self.stats}, index hit rate: {u.p(self.stats["index_hits"], lookups)}%, '
+                    f'in memory: {len(self.memory)} '
+                    f'({self.size} of {self.memory_budget} rows)')
@@ -1,7 +1,10 @@
 from sqlalchemy import func, false
 
 import py.utils as u
-from database.db_connect import session, Game, Player, Variant
+import py.game_store as gs
+import py.report_engine as engine
+import py.teammates as tm
+from database.db_connect import session, Game
 
 
 def get_teammates(username):
@@ -42,21 +45,19 @@ def get_teammate_win_rate(username, teammates_list):
         Teammate's win rate sorted by win rate in descending order
     """
     teammate_win_rate_dict = {}
-    games = session.query(Game, Variant)\
-        .join(Variant)\
+    games = session.query(Game)\
         .filter(Game.players.any(username))\
         .filter(Game.num_players != 2)\
         .filter(Game.speedrun == false())\
         .all()
     for teammate in teammates_list:
         # print(games[0].__table__.columns) - list of props
-        games_count = len([game for game, variant in games if teammate in game.players])
+        games_count = len([game for game in games if teammate in game.players])
 
         if games_count < 100:
             continue
 
-        wins_count = len([game for game, variant in games if teammate in game.players
-                          and game.score == variant.max_score])
+        wins_count = u.get_wins_db([game for game in games if teammate in game.players])
         win_rate = u.p(wins_count, games_count)
         teammate_win_rate_dict[teammate] = win_rate
     return u.sort_by_value(teammate_win_rate_dict)
@@ -110,13 +111,15 @@ def update_preference(player_teammate_preference, teammate_preference_dict):
     return player_teammate_preference
 
 
-def average_preference(player_preference):
+def average_preference(player_preference, users):
     """Averages global dict of preferences.
 
     Parameters
     ----------
     player_preference : dict
         Preference towards a player
+    users : list
+        Players to keep
 
     Returns
     -------
@@ -131,16 +134,27 @@ def average_preference(player_preference):
     return {player: preference for player, preference in player_preference.items() if player in users}
 
 
-if __name__ == "__main__":
-    users = session.query(Player.player).all()
-    users = [user[0] for user in users]
+def save_all(users_win_rate, users):
+    """Calculates the average preference towards each player and saves it.
+
+    Parameters
+    ----------
+    users_win_rate : dict
+        Teammate's win rate grouped by player
+    users : list
+        Players
+    """
     users_preference = {k: {'preference': 0, 'lists_count': 0} for k in users}
     for user in users:
-        teammates = get_teammates(user)
-        teammate_win_rate = get_teammate_win_rate(user, teammates)
-        teammate_preference = get_preference(teammate_win_rate)
+        teammate_preference = get_preference(users_win_rate[user])
         users_preference = update_preference(users_preference, teammate_preference)
 
-    users_preference = average_preference(users_preference)
+    users_preference = average_preference(users_preference, users)
     u.save_header('../output/ratio/preference1', ['Username', 'Preference'])
     u.save_value('../output/ratio/preference1', u.sort_by_value(users_preference))
+
+
+if __name__ == "__main__":
+    all_users = engine.get_users()
+    teammate_matrix = tm.build(gs.get_store())
+    save_all({user: teammate_matrix.win_rates(user) for user in all_users}, all_users)
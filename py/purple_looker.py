@@ -1,11 +1,13 @@
-import requests
 import csv
 import calendar
 from itertools import groupby
 
+from py.history_cache import HistoryCache
+
 
 def open_stats(user):
-    """Gets user's statistics from the history page.
+    """Gets user's statistics from the history page, fetching only the games
+    played since the stored history.
 
     Parameters
     ----------
@@ -17,9 +19,7 @@ def open_stats(user):
     list
         History in json format
     """
-    url = f'https://hanab.live/api/v1/history-full/{user}'
-    response = requests.get(url)
-    return response.json()
+    return HistoryCache().refresh(user)
 
 
 def clear_2p(stats):
@@ -2,7 +2,9 @@ import csv
 from sqlalchemy import false
 
 import py.utils as u
-from database.db_connect import session, Game, Player
+from py.report_engine import Accumulator
+import py.report_engine as engine
+from database.db_connect import session, Game
 
 
 def get_purples_dates():
@@ -62,6 +64,27 @@ def count_purple_games(username, player_purple_date_dict):
     return purple_games_count
 
 
+class PurpleGames(Accumulator):
+    """Number of games with purple players, as count_purple_games for all players at once."""
+
+    def __init__(self, player_purple_date_dict):
+        super().__init__()
+        self.player_purple_date_dict = player_purple_date_dict
+
+    def new(self):
+        return 0
+
+    def add(self, player, g):
+        for teammate in g.players:
+            if (
+                    teammate != player and
+                    teammate in self.player_purple_date_dict and
+                    self.player_purple_date_dict[teammate] < g.date_time_finished
+            ):
+                self.players[player] = self.get(player) + 1
+                break
+
+
 def save_purples(purples_count_dict):
     """Saves number of games with purple players into a tsv file.
 
@@ -78,10 +101,4 @@ def save_purples(purples_count_dict):
 
 
 if __name__ == "__main__":
-    purples_dates = get_purples_dates()
-    users = session.query(Player.player).all()
-    purples = {}
-    for user in users:
-        user = user[0]
-        purples[user] = count_purple_games(user, purples_dates)
-    save_purples(purples)
+    save_purples(engine.run([PurpleGames(get_purples_dates())])[0])
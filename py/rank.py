@@ -0,0 +1,111 @@
+import csv
+
+import numpy as np
+from decouple import config
+
+import py.game_store as gs
+import py.teammates as tm
+import py.variants as variants
+from py.utils import logger
+
+
+# teammates with fewer shared games are not ranked
+RANK_MIN_GAMES = config('RANK_MIN_GAMES', default=100, cast=int)
+# size of the top and bottom lists, the first of the top list receives that many points
+RANK_TOP = config('RANK_TOP', default=5, cast=int)
+
+
+def rank_mask(store):
+    """Mask of 3+ players games without speedruns and double dark variants."""
+    return store.team_games() & ~np.isin(store.variant_id, variants.double_dark_ids())
+
+
+def calculate_ranks(matrix, min_games=RANK_MIN_GAMES, top=RANK_TOP):
+    """Calculates the rank of every player at once, see the rank calculation algorithm in the README.
+
+    Each player's teammates with at least `min_games` shared games are sorted by W/L,
+    ties by more shared games and then by name. The first half is the top list and the second half
+    is the bottom list. With an odd number of teammates the middle one joins the list whose
+    neighbour has the closest W/L, the top list if both are equally close.
+    The first `top` teammates of the top list receive top..1 points, the last `top` teammates
+    of the bottom list receive -top..-1 points, the last one -top.
+
+    Parameters
+    ----------
+    matrix : TeammateMatrix
+        Shared games and wins
+    min_games : int
+        Minimal number of shared games
+    top : int
+        Size of the top and bottom lists
+
+    Returns
+    -------
+    ndarray
+        Rank by player id
+    """
+    players_count = len(matrix.players)
+    rows = np.repeat(np.arange(players_count), np.diff(matrix.indptr))
+    keep = (matrix.games >= min_games) & (matrix.indices != rows)
+    rows, teammates = rows[keep], matrix.indices[keep]
+    games, wins = matrix.games[keep], matrix.wins[keep]
+    losses = games - wins
+    # no losses: above any ratio
+    wl = np.where(losses != 0, wins / np.maximum(losses, 1), np.inf)
+    name_order = np.empty(players_count, dtype=np.int64)
+    name_order[np.argsort(np.array(matrix.players, dtype=object))] = np.arange(players_count)
+    # the last key is the primary one: by player, W/L descending, games descending, name
+    order = np.lexsort((name_order[teammates], -games, -wl, rows))
+    rows, teammates, wl = rows[order], teammates[order], wl[order]
+
+    counts = np.bincount(rows, minlength=players_count)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    n = counts[rows]
+    index = np.arange(len(rows))
+    position = index - starts[rows]
+    half = n // 2
+
+    # distances from the middle teammate of an odd list to its neighbours, two infinite W/L are equal
+    middle = (n % 2 == 1) & (position == half)
+    prev_wl = np.where(position > 0, wl[np.maximum(index - 1, 0)], np.inf)
+    next_wl = np.where(position < n - 1, wl[np.minimum(index + 1, len(rows) - 1)], -np.inf)
+    with np.errstate(invalid='ignore'):
+        to_prev = np.nan_to_num(np.abs(wl - prev_wl), nan=0.0, posinf=np.inf)
+        to_next = np.nan_to_num(np.abs(wl - next_wl), nan=0.0, posinf=np.inf)
+    # lists where the middle teammate joins the top
+    middle_in_top = np.zeros(players_count, dtype=bool)
+    middle_in_top[rows[middle & (to_prev <= to_next)]] = True
+    top_size = half + middle_in_top[rows]
+    bottom_size = n - top_size
+
+    from_end = n - 1 - position
+    in_top = (position < top_size) & (position < top)
+    in_bottom = (from_end < bottom_size) & (from_end < top)
+    points = np.where(in_top, top - position, 0) - np.where(in_bottom, top - from_end, 0)
+    ranks = np.bincount(teammates, weights=points, minlength=players_count).astype(np.int64)
+    logger.info(f'rank: {len(rows)} teammate pairs, {int(np.count_nonzero(counts))} lists')
+    return ranks
+
+
+def save(matrix, ranks):
+    """Saves the rank of each player with a non-zero rank into a tsv file.
+
+    Parameters
+    ----------
+    matrix : TeammateMatrix
+        Shared games and wins
+    ranks : ndarray
+        Rank by player id
+    """
+    with open('../output/ratio/rank.tsv', 'w', encoding='utf-8', newline='') as file:
+        w = csv.writer(file, delimiter='\t', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        w.writerow(['Player', 'Rank'])
+        for p in np.argsort(-ranks, kind='stable'):
+            if ranks[p] != 0:
+                w.writerow([matrix.players[p], int(ranks[p])])
+
+
+if __name__ == "__main__":
+    game_store = gs.get_store()
+    teammate_matrix = tm.build(game_store, rank_mask(game_store))
+    save(teammate_matrix, calculate_ranks(teammate_matrix))
@@ -0,0 +1,149 @@
+from collections import namedtuple
+
+from decouple import config
+from sqlalchemy import false
+
+import py.variants as variants
+from py.utils import logger
+from database.db_connect import session, Game, Player
+
+
+# number of games fetched from the server-side cursor at once
+REPORT_BATCH_SIZE = config('REPORT_BATCH_SIZE', default=10000, cast=int)
+
+COLUMNS = [
+    Game.game_id,
+    Game.players,
+    Game.num_players,
+    Game.speedrun,
+    Game.variant_id,
+    Game.variant,
+    Game.score,
+    Game.end_condition,
+    Game.starting_player,
+    Game.date_time_started,
+    Game.date_time_finished,
+    Game.is_win
+]
+# the selected columns and whether the game was won, also for games without the stored flag
+ReportGame = namedtuple('ReportGame', [c.key for c in COLUMNS] + ['win'])
+
+
+class Accumulator:
+    """Collects the result of a report for each player from the games streamed by the engine.
+
+    Subclasses implement `new`, the initial value of a player, and `add`, which is called
+    for every player of every accepted game, and may override `result`.
+    """
+
+    # 3+ players games without speedruns, as most reports use
+    team_games_only = True
+
+    def __init__(self):
+        self.players = {}
+
+    def accepts(self, g):
+        return not self.team_games_only or (g.num_players != 2 and not g.speedrun)
+
+    def new(self):
+        raise NotImplementedError
+
+    def get(self, player):
+        if player not in self.players:
+            self.players[player] = self.new()
+        return self.players[player]
+
+    def add(self, player, g):
+        raise NotImplementedError
+
+    def result(self, users):
+        return {user: self.players[user] if user in self.players else self.new() for user in users}
+
+
+def get_users():
+    return {user[0] for user in session.query(Player.player).all()}
+
+
+def stream_games(batch_size=REPORT_BATCH_SIZE, query_filter=None):
+    """Yields all games in id order, reading them in batches from a server-side cursor.
+
+    Parameters
+    ----------
+    batch_size : int
+        Number of games fetched at once
+    query_filter : list
+        Filter expressions applied to the query
+
+    Returns
+    -------
+    generator
+        ReportGame for each game
+    """
+    query = session.query(*COLUMNS)
+    if query_filter is not None:
+        query = query.filter(*query_filter)
+    for row in query.order_by(Game.game_id).yield_per(batch_size):
+        win = row.is_win if row.is_win is not None else bool(variants.is_win(row.score, row.variant_id))
+        yield ReportGame(*row, win)
+
+
+def run(accumulators, users=None, batch_size=REPORT_BATCH_SIZE):
+    """Streams the games once and feeds each game to the accumulators of each of its players.
+
+    Parameters
+    ----------
+    accumulators : list
+        Accumulators
+    users : set
+        Players to collect results for, all players from the players table by default
+    batch_size : int
+        Number of games fetched at once
+
+    Returns
+    -------
+    list
+        Result of each accumulator
+    """
+    if users is None:
+        users = get_users()
+    # the table is scanned once, games unused by every report are left out by the db
+    query_filter = None
+    if all(acc.team_games_only for acc in accumulators):
+        query_filter = [Game.num_players != 2, Game.speedrun == false()]
+    games_count = 0
+    for g in stream_games(batch_size, query_filter):
+        games_count += 1
+        for acc in accumulators:
+            if not acc.accepts(g):
+                continue
+            for player in g.players:
+                if player in users:
+                    acc.add(player, g)
+        if games_count % (batch_size * 10) == 0:
+            logger.info(f'reports: {games_count} games')
+    logger.info(f'reports: {games_count} games, {len(users)} players')
+    return [acc.result(users) for acc in accumulators]
+
+
+if __name__ == "__main__":
+    import py.end_condition as end_condition
+    import py.fav_suits as fav_suits
+    import py.purples as purples
+    import py.starting_player as starting_player
+    import py.time_spent as time_spent
+
+    # preference is derived from the teammate matrix, see py/teammates.py
+    all_users = get_users()
+    conditions, suits, alice_ratio, times, purple_games = run([
+        end_condition.EndConditions(),
+        fav_suits.FavSuits(),
+        starting_player.StartingPlayer(),
+        time_spent.TimeSpent(),
+        purples.PurpleGames(purples.get_purples_dates())
+    ], all_users)
+    end_condition.save(end_condition.sort_terminated(conditions))
+    fav_suits.save_all(suits)
+    fav_suits.save_top(suits)
+    starting_player.save(alice_ratio)
+    time_spent.save_all(times)
+    purples.save_purples(purple_games)
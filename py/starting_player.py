@@ -1,7 +1,9 @@
 from sqlalchemy import false
 
 import py.utils as u
-from database.db_connect import session, Game, Player
+from py.report_engine import Accumulator
+import py.report_engine as engine
+from database.db_connect import session, Game
 
 
 def get_alice_wr(username):
@@ -36,10 +38,7 @@ def get_alice_wr(username):
     # num games going first
     alice_games = len(alice_list)
     # num wins going first
-    alice_wins = 0
-    for alice_game in alice_list:
-        if alice_game.score == u.get_max_score(alice_game.variant):
-            alice_wins += 1
+    alice_wins = u.get_wins_db(alice_list)
     # num game not going first
     bob_games = total_games - alice_games
     # num wins not going first
@@ -48,13 +47,42 @@ def get_alice_wr(username):
     return formula, alice_wins, alice_games, bob_wins, bob_games
 
 
-if __name__ == "__main__":
-    users = session.query(Player.player).all()
-    alice_ratio_dict = {}
-    for user in users:
-        user = user[0]
-        alice_ratio_dict[user] = get_alice_wr(user)
+class StartingPlayer(Accumulator):
+    """Games and wins played as Alice and not Alice, as get_alice_wr for all players at once."""
+
+    def new(self):
+        # wins and games overall, wins and games going first
+        return [0, 0, 0, 0]
+
+    def add(self, player, g):
+        counts = self.get(player)
+        counts[0] += g.win
+        counts[1] += 1
+        if g.players[g.starting_player] == player:
+            counts[2] += g.win
+            counts[3] += 1
+
+    def result(self, users):
+        """Players without games or wins on either side have no ratio and are left out."""
+        alice_ratio_dict = {}
+        for user in users:
+            total_wins, total_games, alice_wins, alice_games = self.players.get(user, self.new())
+            bob_wins, bob_games = total_wins - alice_wins, total_games - alice_games
+            if alice_games == 0 or bob_games == 0 or bob_wins == 0:
+                continue
+            formula = round((alice_wins / alice_games) / (bob_wins / bob_games), 2)
+            alice_ratio_dict[user] = formula, alice_wins, alice_games, bob_wins, bob_games
+        return alice_ratio_dict
+
+
+def save(alice_ratio_dict):
+    """Saves the ratio of wins as Alice and not Alice by player into a tsv file.
 
+    Parameters
+    ----------
+    alice_ratio_dict : dict
+        Ratio, wins and games as both Alice and not Alice grouped by player
+    """
     u.save('../output/winrate/alice/starting_player', u.sort(alice_ratio_dict, 0), [
         'Player',
         'Ratio',
@@ -63,3 +91,7 @@ if __name__ == "__main__":
         '!Alice\'s wins',
         '!Alice\'s games'
     ])
+
+
+if __name__ == "__main__":
+    save(engine.run([StartingPlayer()])[0])
@@ -0,0 +1,170 @@
+import csv
+
+import numpy as np
+from decouple import config
+
+import py.utils as u
+import py.game_store as gs
+from py.utils import logger
+
+
+# number of games turned into pairs at once
+TEAMMATES_CHUNK_SIZE = config('TEAMMATES_CHUNK_SIZE', default=200000, cast=int)
+# only teammates with more shared games are saved to wr_by_teammates.tsv, as in wr_by_teammates.sql
+WR_MIN_GAMES = config('WR_MIN_GAMES', default=50, cast=int)
+
+
+class TeammateMatrix:
+    """Sparse player x player matrix of shared games and shared wins, by default of 3+ players games without speedruns.
+
+    Rows are stored in CSR form: the teammates of player p are `indices[indptr[p]:indptr[p + 1]]`
+    in increasing order with the counts at the same positions of `games` and `wins`.
+    The diagonal holds the player's own games and wins.
+    """
+
+    def __init__(self, players, indptr, indices, games, wins):
+        self.players = players
+        self.player_ids = {player: i for i, player in enumerate(players)}
+        self.indptr = indptr
+        self.indices = indices
+        self.games = games
+        self.wins = wins
+
+    def row(self, player):
+        """Teammate ids, shared games and shared wins of the player, including the player."""
+        p = self.player_ids.get(player)
+        if p is None:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+        start, end = self.indptr[p], self.indptr[p + 1]
+        return self.indices[start:end], self.games[start:end], self.wins[start:end]
+
+    def teammates(self, player, min_games=1):
+        """Shared wins and games with each teammate.
+
+        Parameters
+        ----------
+        player : str
+            Player name
+        min_games : int
+            Minimal number of shared games
+
+        Returns
+        -------
+        dict
+            (wins, games) by teammate
+        """
+        teammate_ids, games, wins = self.row(player)
+        keep = (games >= min_games) & (teammate_ids != self.player_ids.get(player, -1))
+        return {
+            self.players[t]: (int(w), int(g))
+            for t, w, g in zip(teammate_ids[keep], wins[keep], games[keep])
+        }
+
+    def win_rates(self, player, min_games=100):
+        """Win rate by a teammate as in preference.get_teammate_win_rate.
+
+        Returns
+        -------
+        dict
+            Teammate's win rate sorted by win rate in descending order
+        """
+        return u.sort_by_value({
+            teammate: u.p(wins_count, games_count)
+            for teammate, (wins_count, games_count) in self.teammates(player, min_games).items()
+        })
+
+
+def count_pairs(keys, wins):
+    """Sums the occurrences and the wins of each key.
+
+    Returns
+    -------
+    tuple
+        Unique keys in increasing order, their counts and their wins
+    """
+    unique_keys, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    return unique_keys, counts, np.bincount(inverse.ravel(), weights=wins, minlength=len(unique_keys)).astype(np.int64)
+
+
+def build(store, mask=None, chunk_size=TEAMMATES_CHUNK_SIZE):
+    """Builds the matrix in one pass over the games of the store.
+
+    Games are grouped by team size, so the players of a chunk form a 2d array and
+    all ordered pairs of a team are taken at once. Each chunk is reduced to unique pairs
+    and the partial counts are summed at the end.
+
+    Parameters
+    ----------
+    store : GameStore
+        Games snapshot
+    mask : ndarray
+        Games to count, 3+ players games without speedruns by default
+    chunk_size : int
+        Number of games turned into pairs at once
+
+    Returns
+    -------
+    TeammateMatrix
+        The matrix
+    """
+    players_count = len(store.players)
+    team_sizes = np.diff(store.team_offsets)
+    team_games = store.team_games() if mask is None else mask
+    partial = []
+    for size in np.unique(team_sizes[team_games]):
+        rows = np.flatnonzero(team_games & (team_sizes == size))
+        first, second = np.meshgrid(np.arange(size), np.arange(size), indexing='ij')
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            team = store.team[store.team_offsets[chunk][:, None] + np.arange(size)].astype(np.int64)
+            # player * players_count + teammate for every ordered pair including the player itself
+            keys = team[:, first.ravel()] * players_count + team[:, second.ravel()]
+            wins = np.repeat(store.win[chunk], size * size)
+            partial.append(count_pairs(keys.ravel(), wins))
+    if len(partial) == 0:
+        keys, games, wins = (np.empty(0, dtype=np.int64),) * 3
+    else:
+        keys, counts, partial_wins = (np.concatenate(a) for a in zip(*partial))
+        keys, inverse = np.unique(keys, return_inverse=True)
+        games = np.bincount(inverse.ravel(), weights=counts, minlength=len(keys)).astype(np.int64)
+        wins = np.bincount(inverse.ravel(), weights=partial_wins, minlength=len(keys)).astype(np.int64)
+    indptr = np.zeros(players_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys // players_count, minlength=players_count), out=indptr[1:])
+    logger.info(f'teammates: {len(keys)} pairs of {players_count} players')
+    return TeammateMatrix(store.players, indptr, keys % players_count, games, wins)
+
+
+def save_wr_by_teammates(matrix, players, min_games=WR_MIN_GAMES):
+    """Saves win rate with each teammate, the player's own row included, by player and then by win rate.
+
+    Parameters
+    ----------
+    matrix : TeammateMatrix
+        Shared games and wins
+    players : list
+        Players to save
+    min_games : int
+        Teammates with at most that many shared games are left out
+    """
+    with open('../output/winrate/wr_by_teammates.tsv', 'w', encoding='utf-8', newline='') as file:
+        w = csv.writer(file, delimiter='\t', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        w.writerow(['Player', 'Teammate', 'WR', 'Wins', 'Games'])
+        for player in sorted(players):
+            teammate_ids, games, wins = matrix.row(player)
+            rows = [
+                (matrix.players[t], u.p(int(wi), int(g)), int(wi), int(g))
+                for t, wi, g in zip(teammate_ids, wins, games) if g > min_games
+            ]
+            for teammate, wr, wins_count, games_count in sorted(rows, key=lambda row: -row[1]):
+                w.writerow([player, teammate, wr, wins_count, games_count])
+
+
+if __name__ == "__main__":
+    import py.preference as preference
+    import py.report_engine as engine
+
+    teammate_matrix = build(gs.get_store())
+    save_wr_by_teammates(teammate_matrix, u.open_file('../input/list_of_players.txt'))
+    all_users = engine.get_users()
+    preference.save_all({user: teammate_matrix.win_rates(user) for user in all_users}, all_users)
@@ -2,7 +2,9 @@ import csv
 from itertools import groupby
 
 import py.utils as u
-from database.db_connect import session, Game, Player
+from py.report_engine import Accumulator
+import py.report_engine as engine
+from database.db_connect import session, Game
 
 
 def save(player_times_dict):
@@ -68,13 +70,42 @@ def get_times(username):
     return times
 
 
-if __name__ == "__main__":
-    users = session.query(Player.player).all()
-    users_times = {}
-    for user in users:
-        user = user[0]
-        users_times[user] = get_times(user)
+class TimeSpent(Accumulator):
+    """Time spent on games, as get_times for all players at once."""
+
+    team_games_only = False
+
+    def new(self):
+        # total seconds, number of games and days, date of the last game
+        return [0, 0, 0, None]
+
+    def add(self, player, g):
+        times = self.get(player)
+        times[0] += (g.date_time_finished - g.date_time_started).total_seconds()
+        times[1] += 1
+        # games come in id order, consecutive games on the same date are one group as in group_stats
+        if g.date_time_finished.date() != times[3]:
+            times[2] += 1
+            times[3] = g.date_time_finished.date()
+
+    def result(self, users):
+        """Players without games are left out."""
+        return {
+            user: [self.players[user][0],
+                   self.players[user][0] / self.players[user][1] / 60,
+                   self.players[user][0] / self.players[user][2] / 3600]
+            for user in users if user in self.players
+        }
+
+
+def save_all(users_times):
+    """Converts total seconds to days and rounds the times before saving them.
 
+    Parameters
+    ----------
+    users_times : dict
+        Total seconds, minutes per game and hours per day by player
+    """
     users_times = {k: [
         u.convert_sec_to_day(v[0]),
         round(v[1]),
@@ -82,3 +113,7 @@ if __name__ == "__main__":
     ]
         for k, v in u.sort(users_times, 0).items()}
     save(users_times)
+
+
+if __name__ == "__main__":
+    save_all(engine.run([TimeSpent()])[0])
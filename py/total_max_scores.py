@@ -1,7 +1,7 @@
-import requests
 from bs4 import BeautifulSoup
 
 import py.utils as u
+from py.client import Client
 from database.db_connect import session, Player
 
 
@@ -14,15 +14,12 @@ def get_content(url, username, req_session=None):
         URL
     username : str
         Player name
-    req_session
-        Session
+    req_session : Client
+        Client to use instead of the shared one
 
     Returns page content.
     """
-    if session is None:
-        page = requests.get(url)
-    else:
-        page = req_session.get(url)
+    page = u.get(url, req_session)
     if page.status_code != 200:
         print('Username is not valid:', username)
         exit()
@@ -49,12 +46,12 @@ def get_total_scores(username, req_session):
     ----------
     username : str
         Player name
-    req_session
-        Session
+    req_session : Client
+        Client to use instead of the shared one
 
     Returns number of scores.
     """
-    url = 'https://hanab.live/missing-scores/' + username
+    url = 'missing-scores/' + username
     soup = get_content(url, username, req_session)
     text = soup.find_all('td')
     return [get_digits(str(t)) for t in text]
@@ -62,7 +59,7 @@ def get_total_scores(username, req_session):
 
 if __name__ == "__main__":
     users = session.query(Player.player).all()
-    request_session = requests.Session()
+    request_session = Client()
     users_scores = {}
     for user in users:
         user = user[0]
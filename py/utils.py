@@ -2,12 +2,15 @@ import csv
 import errno
 import logging
 import os
-import requests
 from datetime import datetime
 from matplotlib import pyplot as plt
 from os import listdir
 from os.path import isfile, join
 
+import numpy as np
+
+import py.variants as variants
+
 logging.basicConfig(
     level=logging.DEBUG,
     format='%(asctime)s - %(levelname)s - %(message)s - %(filename)s:%(lineno)s:%(funcName)s()',
@@ -22,25 +25,112 @@ consoleHandler = logging.StreamHandler()
 logger.addHandler(consoleHandler)
 
 
-def open_stats(user, session=None):
+HISTORY_PAGE_SIZE = 100
+
+
+def get(path, session=None):
+    """Gets the path of the site with the shared http client or the provided one.
+
+    Parameters
+    ----------
+    path : str
+        Path relative to HANABI_URL or URL
+    session : Client
+        Client to use instead of the shared one
+
+    Returns
+    -------
+    Response
+        The response
+    """
+    # imported here, the client uses the logger of this module
+    from py.client import get_client
+
+    return (session or get_client()).get(path)
+
+
+def get_json(path, session=None):
+    return get(path, session).json()
+
+
+def user_url(user):
+    return 'Mat%C3%ADas%20V5' if user == 'Matías_V5' else user
+
+
+def open_stats(user, session=None, start=None):
     """Gets user's statistics from the history page API.
 
     Parameters
     ----------
     user : str
         Player name
-    session : session
-        Current session
+    session : Client
+        Client to use instead of the shared one
+    start : int
+        The first game id to get, all games by default
 
     Returns history in json format
     """
-    user = 'Mat%C3%ADas%20V5' if user == 'Matías_V5' else user
-    url = f'https://hanab.live/api/v1/history-full/{user}'
-    if session is None:
-        response = requests.get(url)
-    else:
-        response = session.get(url)
-    return response.json()
+    url = f'api/v1/history-full/{user_url(user)}'
+    if start is not None:
+        url += f'?start={start}'
+    return get_json(url, session)
+
+
+def open_stats_page(user, page, size=HISTORY_PAGE_SIZE, session=None):
+    """Gets a page of user's games, newest first.
+
+    Parameters
+    ----------
+    user : str
+        Player name
+    page : int
+        Page number
+    size : int
+        Number of games per page
+    session : Client
+        Client to use instead of the shared one
+
+    Returns
+    -------
+    list
+        Games with id, datetime, number of players, score, seed, users and variant id
+    """
+    url = f'api/v1/history/{user_url(user)}?page={page}&size={size}&col[0]=1'
+    return get_json(url, session)['rows']
+
+
+def open_new_stats(user, known_id, session=None, size=HISTORY_PAGE_SIZE):
+    """Gets user's games newer than the known game id. Pages are fetched newest first
+    until the known id is reached, then the full rows of the new games are requested.
+
+    Parameters
+    ----------
+    user : str
+        Player name
+    known_id : int
+        The newest game id which is already stored
+    session : Client
+        Client to use instead of the shared one
+    size : int
+        Number of games per page
+
+    Returns
+    -------
+    list
+        New games in the history-full format
+    """
+    new_ids = []
+    page = 0
+    while True:
+        rows = open_stats_page(user, page, size, session)
+        new_ids += [row['id'] for row in rows if row['id'] > known_id]
+        if len(rows) < size or min(row['id'] for row in rows) <= known_id:
+            break
+        page += 1
+    if len(new_ids) == 0:
+        return []
+    return [row for row in open_stats(user, session, min(new_ids)) if row['id'] > known_id]
 
 
 def open_stats_by_game_id(response, game_id):
@@ -68,16 +158,12 @@ def export_game(game_id, session=None):
     ----------
     game_id : int
         Game id
-    session : session
-        Current session
+    session : Client
+        Client to use instead of the shared one
 
     Returns the game in json format
     """
-    url = f'https://hanab.live/export/{game_id}'
-    if session is None:
-        response = requests.get(url)
-    else:
-        response = session.get(url)
+    response = get(f'export/{game_id}', session)
     if response.status_code == 200:
         return response.json()
     else:
@@ -333,6 +419,47 @@ def contains_user(stats, user):
     return [row for row in stats if user in row['playerNames']]
 
 
+def win_mask(stats):
+    """Marks the games finished with a perfect score using json statistics.
+
+    Parameters
+    ----------
+    stats : list
+        User's games
+
+    Returns
+    -------
+    ndarray
+        True for each won game
+    """
+    scores = np.fromiter((row['score'] for row in stats), dtype=np.int16, count=len(stats))
+    max_scores = np.fromiter(
+        (get_max_score(row['options']['variantName']) for row in stats), dtype=np.int16, count=len(stats)
+    )
+    return scores == max_scores
+
+
+def win_mask_db(stats):
+    """Marks the games finished with a perfect score using the stored win flag of the games.
+    Games without the flag are checked with variants.is_win.
+
+    Parameters
+    ----------
+    stats : list
+        User's games
+
+    Returns
+    -------
+    ndarray
+        True for each won game
+    """
+    return np.fromiter(
+        (row.is_win if row.is_win is not None else bool(variants.is_win(row.score, row.variant_id)) for row in stats),
+        dtype=bool,
+        count=len(stats)
+    )
+
+
 def get_wins(stats):
     """Counts number of games finished with a perfect score using json statistics.
 
@@ -346,7 +473,7 @@ def get_wins(stats):
     int
         Number of games with a perfect score
     """
-    return len([row for row in stats if row['score'] == get_max_score(row['options']['variantName'])])
+    return int(win_mask(stats).sum())
 
 
 def get_losses(stats):
@@ -362,7 +489,7 @@ def get_losses(stats):
     int
         Number of games without a perfect score
     """
-    return len([row for row in stats if row['score'] != get_max_score(row['options']['variantName'])])
+    return len(stats) - get_wins(stats)
 
 
 def get_wins_db(stats):
@@ -378,7 +505,7 @@ def get_wins_db(stats):
     int
         Number of games with a perfect score
     """
-    return len([row for row in stats if row.score == get_max_score(row.variant)])
+    return int(win_mask_db(stats).sum())
 
 
 def get_losses_db(stats):
@@ -394,11 +521,11 @@ def get_losses_db(stats):
     int
         Number of games without a perfect score
     """
-    return len([row for row in stats if row.score != get_max_score(row.variant)])
+    return len(stats) - get_wins_db(stats)
 
 
 def get_number_of_suits(variant):
-    """Gets number of suits for the variant.
+    """Gets number of suits for the variant from the variant registry or, if unknown, from its name.
 
     Parameters
     ----------
@@ -410,21 +537,14 @@ def get_number_of_suits(variant):
     int
         Number of suits for the variant
     """
-    default_suits = {
-        '3 Suits': 3,
-        '4 Suits': 4,
-        'No Variant': 5,
-        '6 Suits': 6,
-        'Dual-Color Mix': 6,
-        'Ambiguous Mix': 6,
-        'Ambiguous & Dual-Color': 6
-    }
-
-    return int(default_suits.get(variant, variant[-8:-7]))
+    variant_info = variants.get(variant)
+    if variant_info is not None and len(variant_info.suits) != 0:
+        return len(variant_info.suits)
+    return variants.count_suits_in_name(variant)
 
 
 def get_max_score(variant):
-    """Calculates the max score for the variant.
+    """Gets the perfect score for the variant, see variants.get_max_score.
 
     Parameters
     ----------
@@ -436,7 +556,7 @@ def get_max_score(variant):
     int
         Max score for the variant
     """
-    return get_number_of_suits(variant) * 5
+    return variants.get_max_score(variant)
 
 
 def get_action_type_length(actions, action_type):
@@ -0,0 +1,256 @@
+import json
+import os
+from collections import namedtuple
+
+from decouple import config
+
+
+# db: variants table, json: resources/variants.json, json by default if no db is configured
+VARIANTS_SOURCE = config('VARIANTS_SOURCE', default='db' if config('POSTGRES_DB', default='') else 'json')
+VARIANTS_JSON = os.path.join(os.path.dirname(__file__), '..', 'resources', 'variants.json')
+
+# suits with one copy of each card
+DARK_SUITS = {
+    'Black',
+    'Dark Rainbow',
+    'Dark Prism',
+    'Gray',
+    'Dark Pink',
+    'Gray Pink',
+    'Dark Brown',
+    'Cocoa Rainbow',
+    'Dark Omni',
+    'Dark Null'
+}
+
+# max scores and efficiencies are indexed by number of players - 2
+VariantInfo = namedtuple('VariantInfo', ['variant_id', 'name', 'suits', 'colors', 'max_score', 'max_scores', 'eff'])
+
+by_id = {}
+by_name = {}
+# unknown keys which already caused a reload
+missing = set()
+
+
+def from_db():
+    """Reads variants from the variants table using a separate session.
+
+    Returns
+    -------
+    list
+        Variants
+    """
+    from database.db_connect import Session, Variant
+
+    variants = []
+    session = Session()
+    for v in session.query(Variant).all():
+        variants.append(VariantInfo(
+            v.variant_id,
+            v.variant,
+            tuple(v.suits or ()),
+            tuple(v.colors or ()),
+            v.max_score,
+            (v.max_score_2p, v.max_score_3p, v.max_score_4p, v.max_score_5p, v.max_score_6p),
+            (v.eff_2p, v.eff_34p, v.eff_34p, v.eff_5p, v.eff_6p)
+        ))
+    session.close()
+    return variants
+
+
+def from_json(path=VARIANTS_JSON):
+    """Reads variants from the json file. The file does not contain colors and efficiency.
+
+    Parameters
+    ----------
+    path : str
+        Path to the file
+
+    Returns
+    -------
+    list
+        Variants
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        variants_json = json.loads(f.read())
+    variants = []
+    for v in variants_json:
+        max_score = len(v['suits']) * 5
+        variants.append(VariantInfo(
+            v['id'],
+            v['name'],
+            tuple(v['suits']),
+            (),
+            max_score,
+            (max_score,) * 5,
+            (None,) * 5
+        ))
+    return variants
+
+
+def load(source=None):
+    """Reads the registry, the keys known to be missing are kept.
+
+    Parameters
+    ----------
+    source : str
+        db or json, VARIANTS_SOURCE by default
+    """
+    global by_id, by_name
+    variants = from_json() if (source or VARIANTS_SOURCE) == 'json' else from_db()
+    by_id = {v.variant_id: v for v in variants}
+    by_name = {v.name: v for v in variants}
+
+
+def refresh(source=None):
+    """Reloads the registry, e.g. when new variants appear, and looks up unknown keys again.
+
+    Parameters
+    ----------
+    source : str
+        db or json, VARIANTS_SOURCE by default
+    """
+    load(source)
+    missing.clear()
+
+
+def get(variant):
+    """Gets a variant by id or name. The registry is loaded on the first call
+    and reloaded once for each unknown variant until the next explicit refresh.
+
+    Parameters
+    ----------
+    variant : int or str
+        Variant id or name
+
+    Returns
+    -------
+    VariantInfo
+        The variant or None
+    """
+    index = by_id if isinstance(variant, int) else by_name
+    if variant not in index and variant not in missing:
+        load()
+        index = by_id if isinstance(variant, int) else by_name
+        if variant not in index:
+            missing.add(variant)
+    return index.get(variant)
+
+
+def is_double_dark(variant):
+    """Checks whether the variant has two dark suits.
+
+    Parameters
+    ----------
+    variant : int or str
+        Variant id or name
+
+    Returns
+    -------
+    bool
+        True if the variant has at least two dark suits
+    """
+    info = get(variant)
+    if info is None:
+        return False
+    # the suits are parsed from the name for variants stored without them
+    suits = info.suits if len(info.suits) != 0 else info.name.split('(')[0].split('&')
+    return sum(suit.replace('Reversed', '').strip() in DARK_SUITS for suit in suits) >= 2
+
+
+def double_dark_ids():
+    """Gets ids of all double dark variants."""
+    if len(by_id) == 0:
+        load()
+    return [variant_id for variant_id in by_id if is_double_dark(variant_id)]
+
+
+def get_eff(variant, num_players):
+    """Gets the variant efficiency for the number of players.
+
+    Parameters
+    ----------
+    variant : int or str
+        Variant id or name
+    num_players : int
+        Number of players
+
+    Returns
+    -------
+    float
+        Efficiency or None
+    """
+    info = get(variant)
+    if info is None or num_players not in range(2, 7):
+        return None
+    return info.eff[num_players - 2]
+
+
+def count_suits_in_name(name):
+    """Gets number of suits of a variant from its name.
+
+    Parameters
+    ----------
+    name : str
+        Variant name
+
+    Returns
+    -------
+    int
+        Number of suits for the variant
+    """
+    default_suits = {
+        '3 Suits': 3,
+        '4 Suits': 4,
+        'No Variant': 5,
+        '6 Suits': 6,
+        'Dual-Color Mix': 6,
+        'Ambiguous Mix': 6,
+        'Ambiguous & Dual-Color': 6
+    }
+    return int(default_suits.get(name, name[-8:-7]))
+
+
+def get_max_score(variant):
+    """Gets the perfect score of the variant, 5 for each suit. The max scores by number of players
+    are the best scores achieved so far and are not used to decide a win.
+
+    Parameters
+    ----------
+    variant : int or str
+        Variant id or name
+
+    Returns
+    -------
+    int
+        Max score or None for an unknown variant id
+    """
+    info = get(variant)
+    if info is not None and info.max_score is not None:
+        return info.max_score
+    if info is not None and len(info.suits) != 0:
+        return len(info.suits) * 5
+    if isinstance(variant, str):
+        return count_suits_in_name(variant) * 5
+    return None
+
+
+def is_win(score, variant):
+    """Checks whether the game was finished with the perfect score of the variant.
+
+    Parameters
+    ----------
+    score : int
+        Score of the game
+    variant : int or str
+        Variant id or name
+
+    Returns
+    -------
+    bool
+        Win or None if the score or the variant is unknown
+    """
+    max_score = get_max_score(variant)
+    if max_score is None or score is None:
+        return None
+    return score == max_score
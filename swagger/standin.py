@@ -0,0 +1,129 @@
+import os
+import random
+import threading
+import time
+
+from decouple import config
+from flask import Flask, request, abort, jsonify
+
+from database.archive import Archive
+from py.utils import logger
+import py.variants as variants
+
+
+# archive with the served games, see database/archive.py, the archive of the generated corpus by default
+STANDIN_ARCHIVE = config(
+    'STANDIN_ARCHIVE',
+    default=os.path.join(os.path.dirname(__file__), '..', 'cache', 'corpus', 'archive')
+)
+STANDIN_PORT = config('STANDIN_PORT', default=5001, cast=int)
+# seconds added to every response: the mean and the maximum deviation
+STANDIN_LATENCY = config('STANDIN_LATENCY', default=0, cast=float)
+STANDIN_JITTER = config('STANDIN_JITTER', default=0, cast=float)
+# share of requests answered with 503
+STANDIN_ERROR_RATE = config('STANDIN_ERROR_RATE', default=0, cast=float)
+# share of game ids which do not exist, as deleted or private games
+STANDIN_GAP_RATE = config('STANDIN_GAP_RATE', default=0, cast=float)
+STANDIN_SEED = config('STANDIN_SEED', default=0, cast=int)
+
+app = Flask(__name__)
+rng = random.Random(STANDIN_SEED)
+rng_lock = threading.Lock()
+archive = None
+# history row of each served game and game ids of each player, newest first
+rows = {}
+histories = {}
+
+
+def is_gap(game_id):
+    return random.Random(f'{STANDIN_SEED}:{game_id}').random() < STANDIN_GAP_RATE
+
+
+def load(path=STANDIN_ARCHIVE):
+    global archive
+    archive = Archive(path, read_only=True)
+    for g, s in archive.games():
+        if is_gap(g['id']):
+            continue
+        rows[g['id']] = s
+        for player in g['players']:
+            histories.setdefault(player, []).append(g['id'])
+    for game_ids in histories.values():
+        game_ids.sort(reverse=True)
+    logger.info(f'stand-in: {len(rows)} games of {len(histories)} players from {path}')
+
+
+@app.before_request
+def simulate():
+    with rng_lock:
+        delay = STANDIN_LATENCY + rng.uniform(-STANDIN_JITTER, STANDIN_JITTER)
+        error = rng.random() < STANDIN_ERROR_RATE
+    if delay > 0:
+        time.sleep(delay)
+    if error:
+        abort(503)
+
+
+@app.route("/export/<int:game_id>")
+def export_game(game_id):
+    if game_id not in rows:
+        abort(404)
+    return jsonify(archive.get(game_id)[0])
+
+
+@app.route("/api/v1/history-full/<player>")
+def get_history_full(player):
+    start = request.args.get('start', 0, type=int)
+    end = request.args.get('end', type=int)
+    return jsonify([
+        rows[game_id] for game_id in histories.get(player, [])
+        if game_id >= start and (end is None or game_id <= end)
+    ])
+
+
+def page_row(s):
+    return {
+        'datetime': s['datetimeFinished'],
+        'id': s['id'],
+        'num_players': s['options']['numPlayers'],
+        'other_scores': s['numGamesOnThisSeed'],
+        'score': s['score'],
+        'seed': s['seed'],
+        'users': ', '.join(s['playerNames']),
+        'variant': s['options']['variantID']
+    }
+
+
+@app.route("/api/v1/history/<path:players>")
+def get_history_page(players):
+    players = players.split('/')
+    page = request.args.get('page', 0, type=int)
+    size = request.args.get('size', 10, type=int)
+    game_ids = set(histories.get(players[0], []))
+    for player in players[1:]:
+        game_ids &= set(histories.get(player, []))
+    game_ids = sorted(game_ids, reverse=request.args.get('col[0]', 1, type=int) == 1)
+    return jsonify({
+        'info': '',
+        'rows': [page_row(rows[game_id]) for game_id in game_ids[page * size:(page + 1) * size]],
+        'total_rows': len(game_ids)
+    })
+
+
+@app.route("/missing-scores/<player>")
+def get_missing_scores(player):
+    max_scores = {v.variant_id: v.max_score for v in variants.from_json()}
+    # variants with a max score by number of players
+    achieved = {num_players: set() for num_players in range(2, 7)}
+    for game_id in histories.get(player, []):
+        opt = rows[game_id]['options']
+        if rows[game_id]['score'] == max_scores.get(opt['variantID']) and opt['numPlayers'] in achieved:
+            achieved[opt['numPlayers']].add(opt['variantID'])
+    counts = [len(achieved[num_players]) for num_players in range(2, 7)]
+    cells = ''.join(f'<td>{count} / {len(max_scores)}</td>' for count in counts + [sum(counts)])
+    return f'<html><body><table><tr>{cells}</tr></table></body></html>'
+
+
+if __name__ == '__main__':
+    load()
+    app.run(port=STANDIN_PORT, threaded=True)
@@ -1,8 +1,9 @@
-import requests
 from flask import Flask, request
 from flasgger import Swagger, LazyString, LazyJSONEncoder
 from flasgger import swag_from
 
+from py.client import get_client
+
 app = Flask(__name__)
 app.json_encoder = LazyJSONEncoder
 swagger_template = dict(
@@ -19,8 +20,8 @@ swagger = Swagger(app, template=swagger_template)
 @app.route("/export/<game_id>")
 def export_game(game_id):
     print(game_id)
-    url = f'https://hanab.live/export/{game_id}'
-    response = requests.get(url)
+    url = f'export/{game_id}'
+    response = get_client().get(url)
     return response.json()
 
 
@@ -43,8 +44,8 @@ def get_history_page(players):
     filters += f'&fcol[2]={score}' if score is not None else ''
     variant_id = request.args.get('variant_id')
     filters += f'&fcol[3]={variant_id}' if variant_id is not None else ''
-    url = f'https://hanab.live/api/v1/history/{players}?page={page}&size={size}&col[0]={sorting}{filters}'
-    response = requests.get(url)
+    url = f'api/v1/history/{players}?page={page}&size={size}&col[0]={sorting}{filters}'
+    response = get_client().get(url)
     return response.json()
 
 